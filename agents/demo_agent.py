@@ -6,6 +6,19 @@ import asyncio
 import json
 from typing import Dict, Any, List
 
+from mcp_server.tools.expand_query import expand_query_tool
+from mcp_server.tools.search_promotions import search_promotions_tool
+from mcp_server.tools.rank_promotions import rank_promotions_tool
+from mcp_server.tools.optimize_ad_slots import optimize_ad_slots_tool
+
+# Actual tool functions backing each MCP tool name, used for demonstration
+_TOOLS = {
+    "expand_query": expand_query_tool,
+    "search_promotions": search_promotions_tool,
+    "rank_promotions": rank_promotions_tool,
+    "optimize_ad_slots": optimize_ad_slots_tool,
+}
+
 
 # Mock MCP client functions (in real usage, these would be MCP calls)
 async def call_mcp_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
@@ -13,28 +26,30 @@ async def call_mcp_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
     Mock function to simulate MCP tool calls.
     In real usage, this would be replaced with actual MCP client calls.
     """
+    _print_tool_call(tool_name, args)
+    result = await _dispatch_tool(tool_name, args)
+    _print_tool_result(result)
+    return result
+
+
+async def _dispatch_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the tool function backing an MCP tool name."""
+    tool = _TOOLS.get(tool_name)
+    if tool is None:
+        raise ValueError(f"Unknown tool: {tool_name}")
+    return await tool(**args)
+
+
+def _print_tool_call(tool_name: str, args: Dict[str, Any]):
+    """Print an MCP tool invocation."""
     print(f"🔧 Calling MCP tool: {tool_name}")
     print(f"   Args: {json.dumps(args, indent=2)}")
-    
-    # Import the actual tool functions for demonstration
-    if tool_name == "expand_query":
-        from mcp_server.tools.expand_query import expand_query_tool
-        result = await expand_query_tool(args["query"])
-    elif tool_name == "search_promotions":
-        from mcp_server.tools.search_promotions import search_promotions_tool
-        result = await search_promotions_tool(args["query"], args["user_profile"])
-    elif tool_name == "rank_promotions":
-        from mcp_server.tools.rank_promotions import rank_promotions_tool
-        result = await rank_promotions_tool(args["candidates"], args["user_profile"])
-    elif tool_name == "optimize_ad_slots":
-        from mcp_server.tools.optimize_ad_slots import optimize_ad_slots_tool
-        result = await optimize_ad_slots_tool(args["search_results"], args["promotions"])
-    else:
-        raise ValueError(f"Unknown tool: {tool_name}")
-    
+
+
+def _print_tool_result(result: Dict[str, Any]):
+    """Print an MCP tool result."""
     print(f"✅ Result: {json.dumps(result, indent=2)}")
     print("-" * 50)
-    return result
 
 
 async def demo_full_pipeline():
@@ -61,21 +76,26 @@ async def demo_full_pipeline():
     
     # Step 2: Search promotions for each expanded query
     print("🔍 Step 2: Semantic Search")
+    search_args = [
+        {"query": expanded_query, "user_profile": user_profile}
+        for expanded_query in expanded_queries[:3]  # Limit to top 3 for demo
+    ]
+    # Searches are independent, so issue them concurrently and log afterwards
+    # to keep the output in query order
+    search_results = await asyncio.gather(*(
+        _dispatch_tool("search_promotions", args) for args in search_args
+    ))
     all_promotions = []
-    for expanded_query in expanded_queries[:3]:  # Limit to top 3 for demo
-        search_result = await call_mcp_tool("search_promotions", {
-            "query": expanded_query,
-            "user_profile": user_profile
-        })
+    for args, search_result in zip(search_args, search_results):
+        _print_tool_call("search_promotions", args)
+        _print_tool_result(search_result)
         all_promotions.extend(search_result["results"])
     
-    # Remove duplicates based on ID
-    seen_ids = set()
-    unique_promotions = []
+    # Remove duplicates based on ID, keeping the first occurrence
+    promotion_lookup = {}
     for promo in all_promotions:
-        if promo["id"] not in seen_ids:
-            unique_promotions.append(promo)
-            seen_ids.add(promo["id"])
+        promotion_lookup.setdefault(promo["id"], promo)
+    unique_promotions = list(promotion_lookup.values())
     
     print(f"📊 Found {len(unique_promotions)} unique promotions")
     
@@ -87,16 +107,8 @@ async def demo_full_pipeline():
     })
     ranked_promotions = ranking_result["ranked_promotions"]
     
-    # Get top promotions with their details
-    top_promotions = []
-    promotion_lookup = {p["id"]: p for p in unique_promotions}
-    
-    for ranked_promo in ranked_promotions[:3]:  # Top 3
-        promo_id = ranked_promo["id"]
-        if promo_id in promotion_lookup:
-            promo_details = promotion_lookup[promo_id].copy()
-            promo_details["rank_score"] = ranked_promo["score"]
-            top_promotions.append(promo_details)
+    # Ranked promotions already carry their details
+    top_promotions = ranked_promotions[:3]
     
     # Step 4: Optimize ad slots
     print("🔍 Step 4: Ad Slot Optimization")
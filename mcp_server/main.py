@@ -3,29 +3,95 @@ Main entry point for the PromoSearch MCP Server.
 """
 
 import os
-import asyncio
-from typing import Any, Dict, List
+import sys
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
+import numpy as np
 from dotenv import load_dotenv
 from loguru import logger
 from fastmcp import FastMCP
+from fastmcp.tools import ToolResult
 
-from .tools.expand_query import expand_query_tool
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+from .tools.expand_query import expand_query_tool, close_llm_clients
 from .tools.search_promotions import search_promotions_tool
 from .tools.rank_promotions import rank_promotions_tool
 from .tools.optimize_ad_slots import optimize_ad_slots_tool
+from .tools.batch_execute import batch_execute_tool
 
 # Load environment variables
 load_dotenv()
 
+def _json_default(value: Any) -> Any:
+    """Convert NumPy arrays and scalars for the JSON encoders; anything else is an error."""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _serialize_tool_result(result: Any) -> str:
+    """
+    Serialize a tool result for the MCP transport.
+    
+    Uses orjson when installed, which encodes numeric NumPy arrays natively;
+    otherwise the stdlib encoder. Other NumPy values are converted to lists,
+    and any other unknown type raises TypeError.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            result,
+            default=_json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode()
+    return json.dumps(result, default=_json_default)
+
+def _tool_result(result: Any) -> ToolResult:
+    """Wrap a tool result as text content encoded by _serialize_tool_result."""
+    return ToolResult(content=_serialize_tool_result(result))
+
+@asynccontextmanager
+async def lifespan(server: FastMCP) -> AsyncIterator[None]:
+    """Close the shared LLM clients on the serving loop, which owns their connection pools."""
+    try:
+        yield
+    finally:
+        await close_llm_clients()
+
 # Initialize MCP server
-mcp = FastMCP("PromoSearch MCP Server")
+mcp = FastMCP("PromoSearch MCP Server", lifespan=lifespan)
 
-# Configure logging
+# Configure logging; sinks are enqueued so writes happen on a background thread
+# instead of blocking the event loop during tool calls
 log_level = os.getenv("LOG_LEVEL", "INFO")
-logger.add("logs/promosearch.log", rotation="1 day", level=log_level)
+logger.remove()
+logger.add(sys.stderr, level=log_level, enqueue=True)
+logger.add("logs/promosearch.log", rotation="1 day", level=log_level,
+           enqueue=True, backtrace=False, diagnose=False)
+
+@asynccontextmanager
+async def time_it(name: str, bound: str) -> AsyncIterator[None]:
+    """
+    Log the wall-clock duration of a tool call.
+    
+    Args:
+        name: Tool name
+        bound: Dominant cost of the tool (e.g. "llm", "embedding", "cpu") for profiling
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"{name} [{bound}-bound] took {elapsed_ms:.1f}ms")
 
 @mcp.tool()
-async def expand_query(query: str) -> Dict[str, List[str]]:
+async def expand_query(query: str) -> ToolResult:
     """
     Use LLM to expand short natural language query into a list of long-tail keyword candidates.
     
@@ -37,15 +103,16 @@ async def expand_query(query: str) -> Dict[str, List[str]]:
     """
     logger.info(f"Expanding query: {query}")
     try:
-        result = await expand_query_tool(query)
+        async with time_it("expand_query", "llm"):
+            result = await expand_query_tool(query)
         logger.info(f"Query expanded to {len(result['expanded_queries'])} variations")
-        return result
+        return _tool_result(result)
     except Exception as e:
         logger.error(f"Error expanding query: {e}")
         raise
 
 @mcp.tool()
-async def search_promotions(query: str, user_profile: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+async def search_promotions(query: str, user_profile: Dict[str, Any]) -> ToolResult:
     """
     Semantic search over promotion index using query and user profile.
     
@@ -58,36 +125,39 @@ async def search_promotions(query: str, user_profile: Dict[str, Any]) -> Dict[st
     """
     logger.info(f"Searching promotions for query: {query}")
     try:
-        result = await search_promotions_tool(query, user_profile)
+        async with time_it("search_promotions", "embedding"):
+            result = await search_promotions_tool(query, user_profile)
         logger.info(f"Found {len(result['results'])} promotion candidates")
-        return result
+        return _tool_result(result)
     except Exception as e:
         logger.error(f"Error searching promotions: {e}")
         raise
 
 @mcp.tool()
-async def rank_promotions(candidates: List[Dict[str, Any]], user_profile: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+async def rank_promotions(candidates: List[Dict[str, Any]], user_profile: Dict[str, Any], top_k: int = 10) -> ToolResult:
     """
     Rank promotion candidates based on predicted click-through rate and user profile.
     
     Args:
         candidates: List of promotion candidates
         user_profile: User profile for personalization
+        top_k: Number of top promotions to return
         
     Returns:
         Dictionary containing ranked_promotions with scores
     """
     logger.info(f"Ranking {len(candidates)} promotion candidates")
     try:
-        result = await rank_promotions_tool(candidates, user_profile)
+        async with time_it("rank_promotions", "cpu"):
+            result = await rank_promotions_tool(candidates, user_profile, top_k)
         logger.info(f"Ranked promotions successfully")
-        return result
+        return _tool_result(result)
     except Exception as e:
         logger.error(f"Error ranking promotions: {e}")
         raise
 
 @mcp.tool()
-async def optimize_ad_slots(search_results: List[str], promotions: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+async def optimize_ad_slots(search_results: List[str], promotions: List[Dict[str, Any]]) -> ToolResult:
     """
     Determine where to insert promotion ads into search result context.
     
@@ -100,13 +170,37 @@ async def optimize_ad_slots(search_results: List[str], promotions: List[Dict[str
     """
     logger.info(f"Optimizing ad slots for {len(promotions)} promotions in {len(search_results)} results")
     try:
-        result = await optimize_ad_slots_tool(search_results, promotions)
+        async with time_it("optimize_ad_slots", "cpu"):
+            result = await optimize_ad_slots_tool(search_results, promotions)
         logger.info(f"Ad slot optimization completed")
-        return result
+        return _tool_result(result)
     except Exception as e:
         logger.error(f"Error optimizing ad slots: {e}")
         raise
 
+@mcp.tool()
+async def batch_execute(calls: List[Dict[str, Any]], max_concurrent: int = 4, stop_on_error: bool = False) -> ToolResult:
+    """
+    Execute several tool calls in one request, running independent calls concurrently.
+    
+    Args:
+        calls: List of {id, tool, args, depends_on} specs; args may contain {"$ref": "<id>.<path>"} placeholders
+        max_concurrent: Maximum number of tool calls running at once
+        stop_on_error: Skip remaining calls after the first failure
+        
+    Returns:
+        Dictionary containing results and errors keyed by call id
+    """
+    logger.info(f"Executing batch of {len(calls)} tool calls")
+    try:
+        async with time_it("batch_execute", "batch"):
+            result = await batch_execute_tool(calls, max_concurrent, stop_on_error)
+        logger.info(f"Batch execution completed with {len(result['errors'])} errors")
+        return _tool_result(result)
+    except Exception as e:
+        logger.error(f"Error executing batch: {e}")
+        raise
+
 def main():
     """Main entry point for the MCP server."""
     host = os.getenv("MCP_SERVER_HOST", "localhost")
@@ -117,7 +211,7 @@ def main():
     # Create logs directory if it doesn't exist
     os.makedirs("logs", exist_ok=True)
     
-    # Run the server
+    # Run the server; the lifespan closes the LLM clients on shutdown
     mcp.run(host=host, port=port)
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+"""
+Caching helpers shared by the PromoSearch tools.
+"""
+
+import asyncio
+import functools
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def async_lru_cache(maxsize: int = 128, key: Optional[Callable[..., Hashable]] = None):
+    """
+    LRU cache decorator for coroutine functions.
+
+    Concurrent calls with the same key wait for a single in-flight call instead
+    of each running it. Only successful results are cached; an exception is
+    raised to the caller and the next call retries.
+
+    Args:
+        maxsize: Maximum number of cached results
+        key: Function mapping the call arguments to a cache key (defaults to the arguments themselves)
+
+    Returns:
+        Decorator adding the cache; the wrapped function gains cache_clear()
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        cache: "OrderedDict[Hashable, T]" = OrderedDict()
+        locks: Dict[Hashable, asyncio.Lock] = {}
+        # Callers holding or waiting on each key's lock; the lock is dropped when none remain
+        users: Dict[Hashable, int] = {}
+
+        def make_key(args, kwargs) -> Hashable:
+            if key is not None:
+                return key(*args, **kwargs)
+            return args + tuple(sorted(kwargs.items()))
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            cache_key = make_key(args, kwargs)
+            if cache_key in cache:
+                cache.move_to_end(cache_key)
+                return cache[cache_key]
+
+            lock = locks.setdefault(cache_key, asyncio.Lock())
+            users[cache_key] = users.get(cache_key, 0) + 1
+            try:
+                async with lock:
+                    # Another caller may have filled the entry while we waited
+                    if cache_key in cache:
+                        cache.move_to_end(cache_key)
+                        return cache[cache_key]
+
+                    result = await func(*args, **kwargs)
+                    cache[cache_key] = result
+                    if len(cache) > maxsize:
+                        cache.popitem(last=False)
+                    return result
+            finally:
+                users[cache_key] -= 1
+                if not users[cache_key]:
+                    del users[cache_key]
+                    del locks[cache_key]
+
+        def cache_clear():
+            # Locks are left alone: they belong to in-flight calls and go away with them
+            cache.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,140 @@
+"""
+Batch execution tool for running several PromoSearch tools in one MCP call.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Set
+from loguru import logger
+
+from .expand_query import expand_query_tool
+from .search_promotions import search_promotions_tool
+from .rank_promotions import rank_promotions_tool
+from .optimize_ad_slots import optimize_ad_slots_tool
+
+# Tools that can be invoked from a batch
+TOOLS = {
+    "expand_query": expand_query_tool,
+    "search_promotions": search_promotions_tool,
+    "rank_promotions": rank_promotions_tool,
+    "optimize_ad_slots": optimize_ad_slots_tool,
+}
+
+
+async def batch_execute_tool(
+    calls: List[Dict[str, Any]],
+    max_concurrent: int = 4,
+    stop_on_error: bool = False
+) -> Dict[str, Any]:
+    """
+    Execute a batch of tool calls, running independent calls concurrently.
+
+    Each call is a dict with 'tool', 'args' and optionally 'id' (defaults to
+    'step<index>') and 'depends_on' (list of call ids). Argument values of the
+    form {"$ref": "step0.expanded_queries"} are replaced with the referenced
+    part of an earlier call's result; referenced calls are implicit dependencies.
+
+    Args:
+        calls: List of tool call specifications
+        max_concurrent: Maximum number of tool calls running at once
+        stop_on_error: Skip all remaining calls after the first failure
+
+    Returns:
+        Dictionary containing results and errors keyed by call id
+    """
+    call_ids = [call.get("id", f"step{i}") for i, call in enumerate(calls)]
+    specs = dict(zip(call_ids, calls))
+    if len(specs) != len(calls):
+        raise ValueError("Duplicate call ids in batch")
+
+    for call_id, call in specs.items():
+        if call.get("tool") not in TOOLS:
+            raise ValueError(f"Unknown tool in call '{call_id}': {call.get('tool')}")
+
+    levels = _dependency_levels(specs)
+    semaphore = asyncio.Semaphore(max(1, max_concurrent))
+    results: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+
+    async def run_call(call_id: str):
+        call = specs[call_id]
+        failed = [dep for dep in _dependencies(call) if dep in errors]
+        if failed:
+            errors[call_id] = f"Dependency failed: {', '.join(failed)}"
+            return
+        try:
+            args = _resolve_refs(call.get("args", {}), results)
+            async with semaphore:
+                results[call_id] = await TOOLS[call["tool"]](**args)
+        except Exception as e:
+            logger.error(f"Error in batch call '{call_id}': {e}")
+            errors[call_id] = str(e)
+
+    for level_index, level in enumerate(levels):
+        await asyncio.gather(*(run_call(call_id) for call_id in level))
+
+        if errors and stop_on_error:
+            for call_id in (c for later in levels[level_index + 1:] for c in later):
+                errors[call_id] = "Skipped after earlier error"
+            break
+
+    logger.info(f"Batch executed {len(results)}/{len(calls)} calls in {len(levels)} levels")
+    return {"results": results, "errors": errors}
+
+
+def _dependencies(call: Dict[str, Any]) -> Set[str]:
+    """Collect explicit and $ref dependencies of a call."""
+    deps = set(call.get("depends_on", []))
+    _collect_refs(call.get("args", {}), deps)
+    return deps
+
+
+def _collect_refs(value: Any, refs: Set[str]):
+    """Add the call ids referenced by $ref placeholders in value to refs."""
+    if isinstance(value, dict):
+        if "$ref" in value:
+            refs.add(value["$ref"].split(".", 1)[0])
+        else:
+            for item in value.values():
+                _collect_refs(item, refs)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_refs(item, refs)
+
+
+def _dependency_levels(specs: Dict[str, Dict[str, Any]]) -> List[List[str]]:
+    """
+    Topologically sort calls into levels whose members can run concurrently.
+    """
+    remaining = {call_id: _dependencies(call) for call_id, call in specs.items()}
+    for call_id, deps in remaining.items():
+        unknown = deps - specs.keys()
+        if unknown:
+            raise ValueError(f"Call '{call_id}' depends on unknown calls: {sorted(unknown)}")
+
+    levels = []
+    done: Set[str] = set()
+    while remaining:
+        level = [call_id for call_id, deps in remaining.items() if deps <= done]
+        if not level:
+            raise ValueError(f"Circular dependency between calls: {sorted(remaining)}")
+        levels.append(level)
+        done.update(level)
+        for call_id in level:
+            del remaining[call_id]
+
+    return levels
+
+
+def _resolve_refs(value: Any, results: Dict[str, Any]) -> Any:
+    """Replace $ref placeholders with values from earlier call results."""
+    if isinstance(value, dict):
+        if "$ref" in value:
+            call_id, *path = value["$ref"].split(".")
+            resolved = results[call_id]
+            for key in path:
+                resolved = resolved[int(key)] if isinstance(resolved, list) else resolved[key]
+            return resolved
+        return {key: _resolve_refs(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve_refs(item, results) for item in value]
+    return value
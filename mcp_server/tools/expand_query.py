@@ -3,10 +3,14 @@ Query expansion tool using LLM to generate long-tail keywords.
 """
 
 import os
+import re
 import json
-from typing import Dict, List
+import functools
+from typing import Dict, List, Optional
 from loguru import logger
 
+from ._cache import async_lru_cache
+
 try:
     import openai
     OPENAI_AVAILABLE = True
@@ -19,6 +23,25 @@ try:
 except ImportError:
     ANTHROPIC_AVAILABLE = False
 
+# Number of LLM expansions cached by (provider, max_queries, normalized query)
+_EXPANSION_CACHE_SIZE = int(os.getenv("EXPAND_CACHE_SIZE", "4096"))
+
+# Lookup tables for rule-based fallback expansion. The token pattern is a single
+# character class with no alternation, so re matches it in one linear pass even on
+# long mixed CJK/Latin input; keep it that way rather than adding Unicode alternations.
+_TOKEN_RE = re.compile(r"[a-z]+")
+_PROMO_TERMS = ("deal", "discount", "sale", "offer", "promotion", "coupon")
+_CLOUD_TERMS = frozenset({"cloud", "aws", "server", "hosting"})
+_MOBILE_TERMS = frozenset({"phone", "mobile", "smartphone"})
+_LAPTOP_TERMS = frozenset({"laptop", "computer", "pc"})
+
+# LLM request limits; a handful of short variations fits well under the token cap
+_MAX_EXPANSION_TOKENS = int(os.getenv("EXPAND_MAX_TOKENS", "120"))
+_LLM_TIMEOUT = float(os.getenv("EXPAND_LLM_TIMEOUT", "5.0"))
+
+# Queries shorter than this skip the LLM and use rule-based expansion
+_BYPASS_MAX_LEN = int(os.getenv("EXPAND_BYPASS_MAX_LEN", "3"))
+
 
 async def expand_query_tool(query: str) -> Dict[str, List[str]]:
     """
@@ -33,6 +56,37 @@ async def expand_query_tool(query: str) -> Dict[str, List[str]]:
     provider = os.getenv("DEFAULT_LLM_PROVIDER", "openai").lower()
     max_queries = int(os.getenv("MAX_EXPANDED_QUERIES", "5"))
     
+    # Trivial queries gain nothing from an LLM round-trip
+    if len(query.strip()) < _BYPASS_MAX_LEN:
+        return {"expanded_queries": _fallback_expansion(query.strip())[:max_queries]}
+    
+    try:
+        if (provider == "openai" and OPENAI_AVAILABLE) or (provider == "anthropic" and ANTHROPIC_AVAILABLE):
+            expanded_queries = list(await _expand_with_llm(provider, max_queries, query))
+        else:
+            # Fallback to rule-based expansion
+            logger.warning(f"LLM provider '{provider}' not available, using fallback")
+            expanded_queries = _fallback_expansion(query)
+            
+        return {"expanded_queries": expanded_queries[:max_queries]}
+        
+    except Exception as e:
+        logger.error(f"Error in query expansion: {e}")
+        # Return fallback expansion on error
+        return {"expanded_queries": _fallback_expansion(query)}
+
+
+@async_lru_cache(
+    maxsize=_EXPANSION_CACHE_SIZE,
+    key=lambda provider, max_queries, query: (provider, max_queries, query.strip().lower())
+)
+async def _expand_with_llm(provider: str, max_queries: int, query: str) -> List[str]:
+    """
+    Expand a query with the given LLM provider.
+    
+    Results are cached per provider and case/whitespace-normalized query, and
+    concurrent identical requests share one LLM call.
+    """
     prompt = f"""
 Expand this search query into {max_queries} related long-tail keyword variations that would help find relevant promotions and deals:
 
@@ -45,72 +99,111 @@ Generate variations that include:
 - Price and budget related terms
 - Seasonal or time-sensitive terms
 
-Return ONLY a JSON array of strings, no other text:
-["variation1", "variation2", "variation3", ...]
+Return ONLY a JSON object with a "queries" array of strings, no other text:
+{{"queries": ["variation1", "variation2", "variation3", ...]}}
 """
 
-    try:
-        if provider == "openai" and OPENAI_AVAILABLE:
-            expanded_queries = await _expand_with_openai(prompt)
-        elif provider == "anthropic" and ANTHROPIC_AVAILABLE:
-            expanded_queries = await _expand_with_anthropic(prompt)
-        else:
-            # Fallback to rule-based expansion
-            logger.warning(f"LLM provider '{provider}' not available, using fallback")
-            expanded_queries = _fallback_expansion(query)
-            
-        return {"expanded_queries": expanded_queries[:max_queries]}
-        
-    except Exception as e:
-        logger.error(f"Error in query expansion: {e}")
-        # Return fallback expansion on error
-        return {"expanded_queries": _fallback_expansion(query)}
+    if provider == "openai":
+        expanded_queries = await _expand_with_openai(prompt)
+    else:
+        expanded_queries = await _expand_with_anthropic(prompt)
+    return expanded_queries[:max_queries]
+
+
+@functools.lru_cache(maxsize=1)
+def _get_openai_client() -> "openai.AsyncOpenAI":
+    """Get the shared OpenAI client so its connection pool stays warm across calls."""
+    return openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_anthropic_client() -> "anthropic.AsyncAnthropic":
+    """Get the shared Anthropic client so its connection pool stays warm across calls."""
+    return anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+
+
+async def close_llm_clients():
+    """Close any shared LLM clients and their HTTP connection pools."""
+    for factory in (_get_openai_client, _get_anthropic_client):
+        if factory.cache_info().currsize:
+            try:
+                await factory().close()
+            except Exception as e:
+                logger.warning(f"Error closing LLM client: {e}")
+            factory.cache_clear()
 
 
 async def _expand_with_openai(prompt: str) -> List[str]:
-    """Expand query using OpenAI API."""
-    client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    """Expand query using OpenAI API, streaming until the query array is complete."""
+    client = _get_openai_client()
     
-    response = await client.chat.completions.create(
+    stream = await client.chat.completions.create(
         model="gpt-3.5-turbo",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.7,
-        max_tokens=200
+        max_tokens=_MAX_EXPANSION_TOKENS,
+        response_format={"type": "json_object"},
+        stream=True,
+        timeout=_LLM_TIMEOUT
     )
     
-    content = response.choices[0].message.content.strip()
+    parts = []
     try:
-        return json.loads(content)
-    except json.JSONDecodeError:
-        # Try to extract JSON from response
-        start = content.find('[')
-        end = content.rfind(']') + 1
-        if start != -1 and end != 0:
-            return json.loads(content[start:end])
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            # Stop reading as soon as the array closes and parses
+            if "]" in delta:
+                expanded_queries = _parse_expansions("".join(parts))
+                if expanded_queries is not None:
+                    return expanded_queries
+    finally:
+        await stream.close()
+    
+    expanded_queries = _parse_expansions("".join(parts))
+    if expanded_queries is None:
         raise ValueError("Could not parse JSON response")
+    return expanded_queries
 
 
 async def _expand_with_anthropic(prompt: str) -> List[str]:
     """Expand query using Anthropic Claude API."""
-    client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    client = _get_anthropic_client()
     
     response = await client.messages.create(
         model="claude-3-haiku-20240307",
-        max_tokens=200,
+        max_tokens=_MAX_EXPANSION_TOKENS,
         temperature=0.7,
-        messages=[{"role": "user", "content": prompt}]
+        messages=[{"role": "user", "content": prompt}],
+        timeout=_LLM_TIMEOUT
     )
     
-    content = response.content[0].text.strip()
+    expanded_queries = _parse_expansions(response.content[0].text)
+    if expanded_queries is None:
+        raise ValueError("Could not parse JSON response")
+    return expanded_queries
+
+
+def _parse_expansions(content: str) -> Optional[List[str]]:
+    """
+    Extract the query array from an LLM response.
+    
+    Accepts either a bare JSON array or an object wrapping one (e.g. {"queries": [...]}).
+    Returns None if no complete array can be parsed yet.
+    """
+    start = content.find('[')
+    end = content.rfind(']') + 1
+    if start == -1 or end <= start:
+        return None
     try:
-        return json.loads(content)
+        queries = json.loads(content[start:end])
     except json.JSONDecodeError:
-        # Try to extract JSON from response
-        start = content.find('[')
-        end = content.rfind(']') + 1
-        if start != -1 and end != 0:
-            return json.loads(content[start:end])
-        raise ValueError("Could not parse JSON response")
+        return None
+    if not isinstance(queries, list):
+        return None
+    return [str(q) for q in queries]
 
 
 def _fallback_expansion(query: str) -> List[str]:
@@ -118,28 +211,29 @@ def _fallback_expansion(query: str) -> List[str]:
     Fallback rule-based query expansion when LLM is not available.
     """
     query_lower = query.lower()
-    expansions = [query]  # Always include original
     
-    # Add common promotional terms
-    promo_terms = ["deal", "discount", "sale", "offer", "promotion", "coupon"]
-    for term in promo_terms:
-        if term not in query_lower:
-            expansions.append(f"{query} {term}")
+    # Tokenize once; singular forms let "servers" match "server" etc.
+    tokens = set(_TOKEN_RE.findall(query_lower))
+    tokens.update([token[:-1] for token in tokens if token.endswith("s")])
+    
+    # Always include original, then add common promotional terms
+    expansions = [query]
+    expansions.extend([f"{query} {term}" for term in _PROMO_TERMS if term not in query_lower])
     
     # Add category-specific expansions
-    if any(word in query_lower for word in ["cloud", "aws", "server", "hosting"]):
+    if not tokens.isdisjoint(_CLOUD_TERMS):
         expansions.extend([
             f"{query} cloud computing",
             f"{query} web hosting deal",
             f"aws {query} discount"
         ])
-    elif any(word in query_lower for word in ["phone", "mobile", "smartphone"]):
+    elif not tokens.isdisjoint(_MOBILE_TERMS):
         expansions.extend([
             f"{query} smartphone deal",
             f"{query} mobile phone offer",
             f"{query} electronics sale"
         ])
-    elif any(word in query_lower for word in ["laptop", "computer", "pc"]):
+    elif not tokens.isdisjoint(_LAPTOP_TERMS):
         expansions.extend([
             f"{query} computer deal",
             f"{query} laptop discount",
@@ -3,9 +3,33 @@ Ad slot optimization tool for determining optimal insertion positions.
 """
 
 import re
-from typing import Dict, List, Any
+import heapq
+from typing import Dict, List, Any, Optional
 from loguru import logger
 
+# Keyword tokenizer and stopwords used for context extraction
+_WORD_RE = re.compile(r'\b[a-zA-Z]{3,}\b')
+_STOPWORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have',
+    'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
+    'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they'
+})
+
+# Keyword -> category lookup for contextual intros
+_KEYWORD_CATEGORIES = {
+    **dict.fromkeys(['cloud', 'server', 'hosting', 'aws', 'api', 'database', 'software'], 'tech'),
+    **dict.fromkeys(['phone', 'mobile', 'smartphone', 'android', 'ios'], 'mobile'),
+    **dict.fromkeys(['business', 'enterprise', 'professional', 'office', 'productivity'], 'business'),
+}
+
+# Category intros, in priority order
+_CATEGORY_INTROS = {
+    'tech': "Perfect for your tech needs!",
+    'mobile': "Great mobile deals for you!",
+    'business': "Boost your business with these offers!",
+}
+
 
 async def optimize_ad_slots_tool(search_results: List[str], promotions: List[Dict[str, Any]]) -> Dict[str, List[str]]:
     """
@@ -60,25 +84,37 @@ def _optimize_insertion_strategy(search_results: List[str], promotions: List[Dic
         return search_results
     
     selected_promotions = promotions[:max_ads]
-    injected_results = []
     
-    # Calculate insertion positions
+    # Calculate insertion positions (ascending) and interleave ads in a single pass
     insertion_positions = _calculate_insertion_positions(len(search_results), max_ads)
+    return _inject_ads(search_results, selected_promotions, insertion_positions)
+
+
+def _inject_ads(search_results: List[str], promotions: List[Dict[str, Any]], positions: List[int]) -> List[str]:
+    """
+    Build the result list with ad copy inserted after each of the given positions.
     
-    promotion_index = 0
-    for i, result in enumerate(search_results):
-        # Add the organic result
-        injected_results.append(result)
+    The output is preallocated and filled with slice copies of the organic runs
+    between ads, so the cost is linear in the number of results.
+    
+    Args:
+        search_results: List of organic search result strings
+        promotions: Promotions to insert, in order
+        positions: Ascending 1-indexed positions after which to insert ads
         
-        # Check if we should insert an ad after this position
-        if i + 1 in insertion_positions and promotion_index < len(selected_promotions):
-            promotion = selected_promotions[promotion_index]
-            
-            # Generate contextual ad copy
-            ad_copy = _generate_ad_copy(promotion, search_results, i)
-            injected_results.append(ad_copy)
-            
-            promotion_index += 1
+    Returns:
+        Organic results interleaved with ad copy
+    """
+    ads = list(zip(positions, promotions))
+    injected_results: List[Optional[str]] = [None] * (len(search_results) + len(ads))
+    
+    previous = 0
+    for inserted, (position, promotion) in enumerate(ads):
+        # Organic results up to this position, shifted by the ads already inserted
+        injected_results[previous + inserted:position + inserted] = search_results[previous:position]
+        injected_results[position + inserted] = _generate_ad_copy(promotion, search_results, position - 1)
+        previous = position
+    injected_results[previous + len(ads):] = search_results[previous:]
     
     return injected_results
 
@@ -166,25 +202,16 @@ def _extract_context_keywords(search_results: List[str], position: int) -> List[
     start_pos = max(0, position - context_window)
     end_pos = min(len(search_results), position + context_window + 1)
     
-    context_text = " ".join(search_results[start_pos:end_pos])
-    
-    # Extract meaningful keywords (simple approach)
-    # Remove common words and extract potential keywords
-    common_words = {
-        'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-        'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have',
-        'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
-        'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they'
-    }
+    context_text = " ".join(search_results[start_pos:end_pos]).lower()
     
-    # Simple keyword extraction
-    words = re.findall(r'\b[a-zA-Z]{3,}\b', context_text.lower())
-    keywords = [word for word in words if word not in common_words]
+    # Count meaningful keywords (simple approach), skipping common words
+    keyword_counts: Dict[str, int] = {}
+    for word in _WORD_RE.findall(context_text):
+        if word not in _STOPWORDS:
+            keyword_counts[word] = keyword_counts.get(word, 0) + 1
     
-    # Return top keywords by frequency
-    from collections import Counter
-    keyword_counts = Counter(keywords)
-    return [word for word, count in keyword_counts.most_common(5)]
+    # Return top keywords by frequency (bounded heap, ties keep first-seen order)
+    return heapq.nlargest(5, keyword_counts, key=keyword_counts.__getitem__)
 
 
 def _generate_contextual_intro(keywords: List[str]) -> str:
@@ -193,21 +220,11 @@ def _generate_contextual_intro(keywords: List[str]) -> str:
         return "Looking for great deals?"
     
     # Check for specific categories
-    tech_keywords = {'cloud', 'server', 'hosting', 'aws', 'api', 'database', 'software'}
-    mobile_keywords = {'phone', 'mobile', 'smartphone', 'android', 'ios'}
-    business_keywords = {'business', 'enterprise', 'professional', 'office', 'productivity'}
-    
-    keyword_set = set(keywords)
-    
-    if keyword_set & tech_keywords:
-        return "Perfect for your tech needs!"
-    elif keyword_set & mobile_keywords:
-        return "Great mobile deals for you!"
-    elif keyword_set & business_keywords:
-        return "Boost your business with these offers!"
-    else:
-        # Generic contextual intro
-        if len(keywords) > 0:
-            return f"Related to {keywords[0]} - check this out!"
-        else:
-            return "You might be interested in this:"
+    matched_categories = {_KEYWORD_CATEGORIES.get(keyword) for keyword in keywords}
+    
+    for category, intro in _CATEGORY_INTROS.items():
+        if category in matched_categories:
+            return intro
+    
+    # Generic contextual intro
+    return f"Related to {keywords[0]} - check this out!"
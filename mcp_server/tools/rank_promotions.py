@@ -2,44 +2,65 @@
 Promotion ranking tool using CTR/CVR prediction models.
 """
 
-from typing import Dict, List, Any
+import numpy as np
+from typing import Dict, List, Any, Optional
 from loguru import logger
 
-from models.ranker import get_ranker
+from models.ranker import get_ranker, ranked_record
 
 
-async def rank_promotions_tool(candidates: List[Dict[str, Any]], user_profile: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+async def rank_promotions_tool(candidates: List[Dict[str, Any]], user_profile: Dict[str, Any],
+                               top_k: Optional[int] = None, as_arrays: bool = False) -> Dict[str, Any]:
     """
     Rank promotion candidates based on predicted click-through rate and user profile.
     
     Args:
         candidates: List of promotion candidates with id, title, description, link
         user_profile: User profile containing user_type, interests, budget_level
+        top_k: Number of top promotions to return (all candidates if None)
+        as_arrays: Return ids and scores as NumPy arrays instead of a list of dicts,
+            for in-process callers that post-process scores in bulk
         
     Returns:
-        Dictionary containing ranked_promotions with id and score
+        Dictionary containing ranked_promotions with id, title, description, link and score,
+        or ids (object array) and scores (float64 array) best first when as_arrays is set
     """
     try:
         if not candidates:
             logger.warning("No candidates provided for ranking")
-            return {"ranked_promotions": []}
+            return _arrays_result([], np.empty(0)) if as_arrays else {"ranked_promotions": []}
         
         # Get the ranker instance
         ranker = get_ranker()
         
         # Rank the promotions
-        ranked_promotions = ranker.rank_promotions(candidates, user_profile)
+        if as_arrays:
+            order, scores = ranker.score_promotions(candidates, user_profile, top_k)
+            ids = [candidates[i].get("id", f"promo_{i}") for i in order.tolist()]
+            result = _arrays_result(ids, scores)
+        else:
+            result = {"ranked_promotions": ranker.rank_promotions(candidates, user_profile, top_k)}
         
         logger.info(f"Ranked {len(candidates)} promotions successfully")
-        return {"ranked_promotions": ranked_promotions}
+        return result
         
     except Exception as e:
         logger.error(f"Error in rank_promotions_tool: {e}")
-        # Return candidates with default scores on error
-        fallback_results = []
-        for i, candidate in enumerate(candidates):
-            fallback_results.append({
-                "id": candidate.get("id", f"promo_{i}"),
-                "score": 0.1  # Default score
-            })
+        # Return candidates with default scores on error, truncated like a ranked result
+        if top_k is not None:
+            candidates = candidates[:top_k]
+        if as_arrays:
+            ids = [candidate.get("id", f"promo_{i}") for i, candidate in enumerate(candidates)]
+            return _arrays_result(ids, np.full(len(ids), 0.1))  # Default score
+        fallback_results = [
+            ranked_record(candidate, i, 0.1)  # Default score
+            for i, candidate in enumerate(candidates)
+        ]
         return {"ranked_promotions": fallback_results}
+
+
+def _arrays_result(ids: List[str], scores: np.ndarray) -> Dict[str, np.ndarray]:
+    """Pack ranked ids and scores into the as_arrays response."""
+    id_array = np.empty(len(ids), dtype=object)
+    id_array[:] = ids
+    return {"ids": id_array, "scores": np.asarray(scores, dtype=np.float64)}
@@ -4,10 +4,20 @@ Semantic search tool for finding relevant promotions.
 
 import os
 import json
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Mapping, Optional, Union
 from loguru import logger
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from models.embedder import EmbeddingModel, PromotionIndex
+from ._cache import async_lru_cache
+
+# Number of searches cached by (query, user profile, result count)
+_SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
 
 # Global instances (initialized on first use)
 _embedder = None
@@ -19,6 +29,8 @@ def _get_embedder() -> EmbeddingModel:
     global _embedder
     if _embedder is None:
         _embedder = EmbeddingModel()
+        # Load the model while the caller reads the promotions data
+        _embedder.start_loading()
     return _embedder
 
 
@@ -42,13 +54,10 @@ def _load_promotions_data():
         return
     
     try:
-        promotions = []
-        with open(data_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    promotion = json.loads(line)
-                    promotions.append(promotion)
+        loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+        with open(data_path, 'rb') as f:
+            lines = f.read().splitlines()
+        promotions = [loads(line) for line in lines if line.strip()]
         
         _promotion_index.add_promotions(promotions)
         logger.info(f"Loaded {len(promotions)} promotions from {data_path}")
@@ -157,46 +166,70 @@ def _load_mock_promotions():
     logger.info(f"Loaded {len(mock_promotions)} mock promotions")
 
 
-async def search_promotions_tool(query: str, user_profile: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+async def search_promotions_tool(query: str, user_profile: Dict[str, Any],
+                                 include_lookup: bool = False) -> Dict[str, Any]:
     """
     Search for promotions using semantic similarity and user profile.
     
     Args:
         query: Search query string
         user_profile: User profile containing user_type, interests, budget_level
+        include_lookup: Also return by_id, the results keyed by promotion id, for
+            in-process callers that join other results back to promotions
         
     Returns:
-        Dictionary containing results list with promotion data
+        Dictionary containing results list with promotion data (and by_id when requested)
     """
     try:
-        max_results = int(os.getenv("MAX_SEARCH_RESULTS", "20"))
-        
-        # Get the promotion index
-        promotion_index = _get_promotion_index()
+        # Nothing to match on, so skip loading the model and scanning the index
+        if not query.strip():
+            logger.warning("Empty query provided for search")
+            return _search_result([], include_lookup)
         
-        # Perform semantic search
-        results = promotion_index.search(
-            query=query,
-            top_k=max_results,
-            user_profile=user_profile
-        )
+        max_results = int(os.getenv("MAX_SEARCH_RESULTS", "20"))
         
-        # Format results for MCP response
-        formatted_results = []
-        for result in results:
-            formatted_result = {
-                "id": result.get("id", ""),
-                "title": result.get("title", ""),
-                "description": result.get("description", ""),
-                "link": result.get("link", ""),
-                "score": result.get("score", 0.0)
-            }
-            formatted_results.append(formatted_result)
+        # Perform semantic search; results are already in MCP response shape
+        results = await _search(_get_promotion_index(), query, user_profile, max_results)
         
-        logger.info(f"Search completed: {len(formatted_results)} results for query '{query}'")
-        return {"results": formatted_results}
+        logger.info(f"Search completed: {len(results)} results for query '{query}'")
+        return _search_result(results, include_lookup)
         
     except Exception as e:
         logger.error(f"Error in search_promotions_tool: {e}")
         # Return empty results on error
-        return {"results": []}
+        return _search_result([], include_lookup)
+
+
+def _search_result(results: List[Dict[str, Any]], include_lookup: bool) -> Dict[str, Any]:
+    """Build the tool response from (possibly cached) results, copying them so callers may mutate."""
+    results = [dict(promo) for promo in results]
+    response = {"results": results}
+    if include_lookup:
+        response["by_id"] = {promo["id"]: promo for promo in results}
+    return response
+
+
+def _profile_key(user_profile: Optional[Mapping[str, Any]]) -> Union[str, bytes]:
+    """Canonical hashable form of a user profile; list and tuple values compare equal."""
+    profile = dict(user_profile or {})
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(profile, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(profile, sort_keys=True, default=str)
+
+
+@async_lru_cache(
+    maxsize=_SEARCH_CACHE_SIZE,
+    key=lambda promotion_index, query, user_profile, top_k: (
+        id(promotion_index), promotion_index.generation, query, _profile_key(user_profile), top_k
+    )
+)
+async def _search(promotion_index: PromotionIndex, query: str, user_profile: Optional[Mapping[str, Any]],
+                  top_k: int) -> List[Dict[str, Any]]:
+    """
+    Search a promotion index.
+    
+    Results are cached per index generation, query, profile and result count, so
+    adding promotions invalidates them. Cached results are shared, so callers
+    must copy them before handing them out.
+    """
+    return promotion_index.search(query=query, top_k=top_k, user_profile=user_profile)
@@ -0,0 +1,90 @@
+"""
+Lexical BM25 index used as a first-stage retriever for promotion search.
+"""
+
+import re
+import numpy as np
+from typing import Dict, List
+from loguru import logger
+from scipy import sparse
+
+_TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens of two or more characters."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    BM25 index with all document scores computed eagerly at build time.
+
+    Scores are stored in a sparse (vocabulary x documents) matrix, so answering a
+    query is a sum of the rows for its tokens followed by a partial sort.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.num_docs = 0
+        self._scores = None
+
+    def build(self, texts: List[str]):
+        """Precompute BM25 scores for every (token, document) pair."""
+        self.num_docs = len(texts)
+        self.vocab = {}
+
+        term_ids, doc_ids, term_freqs = [], [], []
+        doc_lengths = np.zeros(self.num_docs, dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term_id = self.vocab.setdefault(token, len(self.vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_ids.extend(counts.keys())
+            doc_ids.extend([doc_id] * len(counts))
+            term_freqs.extend(counts.values())
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+        tf = np.array(term_freqs, dtype=np.float32)
+
+        doc_freqs = np.bincount(term_ids, minlength=len(self.vocab))
+        idf = np.log1p((self.num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_length = max(float(doc_lengths.mean()) if self.num_docs else 0.0, 1.0)
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths[doc_ids] / avg_length)
+        weights = idf[term_ids] * tf * (self.k1 + 1) / (tf + length_norm)
+
+        self._scores = sparse.csr_matrix(
+            (weights, (term_ids, doc_ids)),
+            shape=(len(self.vocab), self.num_docs)
+        )
+        logger.info(f"BM25 index built: {self.num_docs} documents, {len(self.vocab)} terms")
+
+    def retrieve(self, query: str, k: int) -> np.ndarray:
+        """
+        Retrieve the indices of the top-k documents matching the query.
+
+        Args:
+            query: Search query
+            k: Maximum number of documents to return
+
+        Returns:
+            Document indices with a positive score, best first
+        """
+        if self._scores is None:
+            return np.empty(0, dtype=np.int64)
+
+        term_ids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+        if not term_ids:
+            return np.empty(0, dtype=np.int64)
+
+        scores = np.asarray(self._scores[term_ids].sum(axis=0)).ravel()
+        matches = np.flatnonzero(scores)
+        if matches.size > k:
+            matches = matches[np.argpartition(scores[matches], -k)[-k:]]
+        return matches[np.argsort(-scores[matches], kind="stable")]
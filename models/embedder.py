@@ -3,32 +3,156 @@ Embedding model for semantic search functionality.
 """
 
 import os
-import pickle
+import hashlib
+import functools
+import threading
 import numpy as np
-from typing import List, Dict, Any, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from loguru import logger
 
+from .bm25_index import BM25Index
+
 try:
+    import torch
     from sentence_transformers import SentenceTransformer
     SENTENCE_TRANSFORMERS_AVAILABLE = True
 except ImportError:
     SENTENCE_TRANSFORMERS_AVAILABLE = False
     logger.warning("sentence-transformers not available, using mock embeddings")
 
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+try:
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+try:
+    import simsimd
+    SIMSIMD_AVAILABLE = True
+except ImportError:
+    SIMSIMD_AVAILABLE = False
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Dimension of mock embeddings (same as all-MiniLM-L6-v2)
+MOCK_EMBEDDING_DIM = 384
+
+# SplitMix64 constants for the mock embedding generator
+_SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_SPLITMIX_MUL1 = np.uint64(0xBF58476D1CE4E5B9)
+_SPLITMIX_MUL2 = np.uint64(0x94D049BB133111EB)
+_SHIFT_30, _SHIFT_27, _SHIFT_31, _SHIFT_11 = (np.uint64(n) for n in (30, 27, 31, 11))
+_UNIT_SCALE = 2.0 ** -53
+
+
+def _splitmix_uniform(state):
+    """Advance SplitMix64 state(s) and return (state, uniform sample in (0, 1])."""
+    state = state + _SPLITMIX_GAMMA
+    z = (state ^ (state >> _SHIFT_30)) * _SPLITMIX_MUL1
+    z = (z ^ (z >> _SHIFT_27)) * _SPLITMIX_MUL2
+    z = z ^ (z >> _SHIFT_31)
+    return state, ((z >> _SHIFT_11) + np.uint64(1)) * _UNIT_SCALE
+
+
+def _mock_embedding_kernel_numpy(seeds: np.ndarray, out: np.ndarray):
+    """Fill each row of out with unit-length Gaussian noise seeded by seeds, vectorized over rows."""
+    state = seeds.copy()
+    for j in range(0, out.shape[1], 2):
+        state, u1 = _splitmix_uniform(state)
+        state, u2 = _splitmix_uniform(state)
+        radius = np.sqrt(-2.0 * np.log(u1))
+        out[:, j] = radius * np.cos(2.0 * np.pi * u2)
+        out[:, j + 1] = radius * np.sin(2.0 * np.pi * u2)
+    out /= np.linalg.norm(out, axis=1, keepdims=True)
+
+
+if NUMBA_AVAILABLE:
+    _splitmix_uniform_jit = njit(cache=True)(_splitmix_uniform)
+    
+    @njit(cache=True, parallel=True)
+    def _mock_embedding_kernel(seeds: np.ndarray, out: np.ndarray):
+        """Fill each row of out with unit-length Gaussian noise seeded by seeds, in parallel."""
+        for i in prange(seeds.shape[0]):
+            state = seeds[i]
+            sum_sq = 0.0
+            for j in range(0, out.shape[1], 2):
+                state, u1 = _splitmix_uniform_jit(state)
+                state, u2 = _splitmix_uniform_jit(state)
+                radius = np.sqrt(-2.0 * np.log(u1))
+                out[i, j] = radius * np.cos(2.0 * np.pi * u2)
+                out[i, j + 1] = radius * np.sin(2.0 * np.pi * u2)
+                sum_sq += out[i, j] ** 2 + out[i, j + 1] ** 2
+            out[i] /= np.sqrt(sum_sq)
+else:
+    _mock_embedding_kernel = _mock_embedding_kernel_numpy
+
+
+def _quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetrically quantize each row to int8, returning (int8 rows, float32 per-row scales)."""
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12).astype(np.float32) / 127.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+
+# Single thread that loads embedding models off the caller's critical path
+_model_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-model-loader")
+
 
 class EmbeddingModel:
     """Handles text embeddings for semantic search."""
     
     def __init__(self, model_name: Optional[str] = None):
         self.model_name = model_name or os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+        self.backend = os.getenv("EMBEDDING_BACKEND", "sentence-transformers").lower()
         self.model = None
+        self.tokenizer = None
+        self.batch_size = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+        self.encode_workers = int(os.getenv("EMBED_WORKERS", "2"))
+        self._tokenizer_lock = threading.Lock()  # fast tokenizers must not be called concurrently
         self.cache_path = os.getenv("EMBEDDINGS_CACHE_PATH", "data/embeddings/")
         os.makedirs(self.cache_path, exist_ok=True)
         
-        self._load_model()
+        # The model is loaded in the background on first use (or start_loading)
+        self._load_future: Optional[Future] = None
+        self._load_lock = threading.Lock()
+    
+    def start_loading(self):
+        """Begin loading the model on a background thread if not already started."""
+        with self._load_lock:
+            if self._load_future is None:
+                self._load_future = _model_loader.submit(self._load_model)
+    
+    def _ensure_model(self):
+        """Block until the model has finished loading."""
+        self.start_loading()
+        self._load_future.result()
     
     def _load_model(self):
-        """Load the sentence transformer model."""
+        """Load the embedding model for the configured backend."""
+        if self.backend == "onnx":
+            if ONNX_AVAILABLE:
+                try:
+                    self._load_onnx_model()
+                    return
+                except Exception as e:
+                    logger.error(f"Failed to load ONNX embedding model: {e}")
+            else:
+                logger.warning("ONNX Runtime/optimum not available, using sentence-transformers")
+            self.backend = "sentence-transformers"
+        
         if SENTENCE_TRANSFORMERS_AVAILABLE:
             try:
                 logger.info(f"Loading embedding model: {self.model_name}")
@@ -41,6 +165,57 @@ class EmbeddingModel:
             logger.warning("Using mock embedding model")
             self.model = None
     
+    def _load_onnx_model(self):
+        """Load an INT8-quantized ONNX export of the model, exporting it on first use."""
+        hub_name = self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+        onnx_dir = os.path.join(self.cache_path, "onnx", hub_name.replace("/", "__"))
+        quantized_file = "model_quantized.onnx"
+        
+        if not os.path.exists(os.path.join(onnx_dir, quantized_file)):
+            logger.info(f"Exporting {hub_name} to ONNX with dynamic INT8 quantization")
+            exported = ORTModelForFeatureExtraction.from_pretrained(hub_name, export=True)
+            exported.save_pretrained(onnx_dir)
+            AutoTokenizer.from_pretrained(hub_name).save_pretrained(onnx_dir)
+            quantizer = ORTQuantizer.from_pretrained(exported)
+            quantizer.quantize(
+                save_dir=onnx_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+        
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+        
+        logger.info(f"Loading ONNX embedding model from {onnx_dir}")
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            onnx_dir, file_name=quantized_file, session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        logger.info("ONNX embedding model loaded successfully")
+    
+    def _encode_onnx(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts with the ONNX model in length-sorted batches.
+        
+        Sorting by length keeps similarly sized texts together, so each batch is
+        padded only to its own longest text rather than the longest overall.
+        """
+        embeddings = np.empty((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            embeddings[batch] = self._encode_onnx_batch([texts[i] for i in batch])
+        return embeddings
+    
+    def _encode_onnx_batch(self, texts: List[str]) -> np.ndarray:
+        """Encode one batch with mean pooling and L2 normalization."""
+        with self._tokenizer_lock:
+            tokens = self.tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+        hidden = np.asarray(self.model(**tokens).last_hidden_state, dtype=np.float32)
+        
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    
     def encode(self, texts: List[str]) -> np.ndarray:
         """
         Encode texts into embeddings.
@@ -49,11 +224,18 @@ class EmbeddingModel:
             texts: List of text strings to encode
             
         Returns:
-            numpy array of embeddings
+            numpy array of L2-normalized embeddings, one row per text
         """
+        self._ensure_model()
         if self.model is not None:
             try:
-                embeddings = self.model.encode(texts, convert_to_numpy=True)
+                if self.encode_workers > 1 and len(texts) > self.batch_size:
+                    return self._encode_parallel(texts)
+                if self.backend == "onnx":
+                    return self._encode_onnx(texts)
+                # sentence-transformers already length-sorts within encode
+                embeddings = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                               normalize_embeddings=True)
                 return embeddings
             except Exception as e:
                 logger.error(f"Error encoding texts: {e}")
@@ -61,91 +243,304 @@ class EmbeddingModel:
         else:
             return self._mock_embeddings(texts)
     
+    def _encode_parallel(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode length-sorted batches on a pool of worker threads.
+        
+        Tokenization holds the GIL while the model forward pass releases it, so
+        one worker tokenizes its batch while the others run the model.
+        """
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        batches = [order[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        
+        embeddings = None
+        with ThreadPoolExecutor(max_workers=self.encode_workers) as executor:
+            encoded = executor.map(lambda batch: self._encode_batch([texts[i] for i in batch]), batches)
+            for batch, batch_embeddings in zip(batches, encoded):
+                if embeddings is None:
+                    embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+                embeddings[batch] = batch_embeddings
+        return embeddings
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Encode a single batch with the loaded model."""
+        if self.backend == "onnx":
+            return self._encode_onnx_batch(texts)
+        
+        with self._tokenizer_lock:
+            features = self.model.tokenize(texts)
+        features = {name: tensor.to(self.model.device) for name, tensor in features.items()}
+        # Grad mode is thread-local, so it is disabled again in each worker
+        with torch.inference_mode():
+            embeddings = self.model(features)["sentence_embedding"].float()
+            return torch.nn.functional.normalize(embeddings, dim=1).cpu().numpy()
+    
     def _mock_embeddings(self, texts: List[str]) -> np.ndarray:
         """Generate mock embeddings based on text characteristics."""
-        embeddings = []
-        for text in texts:
-            # Simple hash-based mock embedding
-            text_hash = hash(text.lower()) % 1000000
-            # Create a 384-dimensional vector (same as all-MiniLM-L6-v2)
-            np.random.seed(text_hash)
-            embedding = np.random.normal(0, 1, 384)
-            # Normalize
-            embedding = embedding / np.linalg.norm(embedding)
-            embeddings.append(embedding)
-        
-        return np.array(embeddings)
+        # Simple hash-based mock embedding: Gaussian noise seeded by the text
+        seeds = np.fromiter((hash(text.lower()) & 0xFFFFFFFF for text in texts), dtype=np.uint64, count=len(texts))
+        embeddings = np.empty((len(texts), MOCK_EMBEDDING_DIM), dtype=np.float64)
+        _mock_embedding_kernel(seeds, embeddings)
+        return embeddings
     
     def similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
-        """Calculate cosine similarity between two embeddings."""
-        return np.dot(embedding1, embedding2) / (
-            np.linalg.norm(embedding1) * np.linalg.norm(embedding2)
-        )
+        """Calculate cosine similarity between two embeddings returned by encode (already unit length)."""
+        return float(np.dot(embedding1, embedding2))
+    
+    def text_key(self, text: str) -> str:
+        """Content hash identifying a text's embedding under the current model."""
+        self._ensure_model()
+        identity = f"{self.backend}:{self.model_name}" if self.model is not None else "mock"
+        return hashlib.sha1(f"{identity}\n{text}".encode("utf-8")).hexdigest()
+    
+    def encode_cached(self, texts: List[str], filename: str, force_rebuild: bool = False) -> np.ndarray:
+        """
+        Encode texts, reusing embeddings cached on disk by text content.
+        
+        Only texts missing from the cache are encoded; the cache is then rewritten
+        to hold exactly the given texts. When every text is cached in order, the
+        memory-mapped cache is returned as-is.
+        
+        Args:
+            texts: List of text strings to encode
+            filename: Cache file name (without extension)
+            force_rebuild: Ignore the existing cache and re-encode everything
+            
+        Returns:
+            numpy array of embeddings
+        """
+        keys = [self.text_key(text) for text in texts]
+        cached_keys, cached = ([], None) if force_rebuild else self.load_embedding_cache(filename)
+        
+        if cached is not None and cached_keys == keys:
+            logger.info(f"Embeddings: {len(keys)} cached, 0 encoded")
+            return cached
+        
+        cached_rows = {key: row for row, key in enumerate(cached_keys)}
+        hits = [i for i, key in enumerate(keys) if key in cached_rows]
+        missing = [i for i, key in enumerate(keys) if key not in cached_rows]
+        logger.info(f"Embeddings: {len(hits)} cached, {len(missing)} encoded")
+        
+        new_embeddings = self.encode([texts[i] for i in missing]) if missing else None
+        dim = new_embeddings.shape[1] if new_embeddings is not None else cached.shape[1]
+        embeddings = np.empty((len(keys), dim), dtype=np.float32)
+        if hits:
+            embeddings[hits] = cached[[cached_rows[keys[i]] for i in hits]]
+        if missing:
+            embeddings[missing] = new_embeddings
+        
+        self.save_embedding_cache(keys, embeddings, filename)
+        return embeddings
+    
+    def load_embedding_cache(self, filename: str) -> Tuple[List[str], Optional[np.ndarray]]:
+        """Load a content-addressed embedding cache as (text keys, memory-mapped embeddings)."""
+        keys_path = os.path.join(self.cache_path, f"{filename}.keys.npy")
+        if not os.path.exists(keys_path):
+            return [], None
+        embeddings = self.load_embeddings(filename)
+        if embeddings is None:
+            return [], None
+        try:
+            keys = np.load(keys_path).tolist()
+        except Exception as e:
+            logger.error(f"Failed to load embedding cache keys {keys_path}: {e}")
+            return [], None
+        if len(keys) != len(embeddings):
+            logger.warning(f"Embedding cache {filename} is inconsistent, ignoring it")
+            return [], None
+        return keys, embeddings
+    
+    def save_embedding_cache(self, keys: List[str], embeddings: np.ndarray, filename: str):
+        """Save embeddings together with the text keys identifying each row."""
+        if not keys:
+            return
+        self.save_embeddings(embeddings, filename)
+        _atomic_save(os.path.join(self.cache_path, f"{filename}.keys.npy"), np.array(keys))
     
     def save_embeddings(self, embeddings: np.ndarray, filename: str):
-        """Save embeddings to cache."""
-        filepath = os.path.join(self.cache_path, f"{filename}.pkl")
-        with open(filepath, 'wb') as f:
-            pickle.dump(embeddings, f)
+        """Save embeddings to cache as a raw .npy matrix."""
+        filepath = os.path.join(self.cache_path, f"{filename}.npy")
+        _atomic_save(filepath, np.asarray(embeddings, dtype=np.float32))
         logger.info(f"Embeddings saved to {filepath}")
     
     def load_embeddings(self, filename: str) -> Optional[np.ndarray]:
-        """Load embeddings from cache."""
-        filepath = os.path.join(self.cache_path, f"{filename}.pkl")
-        if os.path.exists(filepath):
-            with open(filepath, 'rb') as f:
-                embeddings = pickle.load(f)
-            logger.info(f"Embeddings loaded from {filepath}")
-            return embeddings
+        """Load embeddings from cache as a read-only memory map."""
+        filepath = os.path.join(self.cache_path, f"{filename}.npy")
+        try:
+            if os.path.exists(filepath):
+                embeddings = np.load(filepath, mmap_mode='r')
+                logger.info(f"Embeddings mapped from {filepath}")
+                return embeddings
+        except Exception as e:
+            logger.error(f"Failed to load embeddings {filename}: {e}")
         return None
 
 
+def _atomic_save(filepath: str, array: np.ndarray):
+    """
+    Write an .npy file via rename, so existing memory maps of it stay valid.
+    
+    The temporary name is unique per process and thread, so concurrent writers
+    (e.g. parallel test workers) never interleave their bytes.
+    """
+    tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, filepath)
+
+
 class PromotionIndex:
     """Index for fast semantic search over promotions."""
     
+    PRICE_TIERS = {'low': 0, 'medium': 1, 'high': 2}
+    
+    # IVF/PQ indexes need ample training data; smaller catalogs use exact NumPy search
+    FAISS_MIN_TRAIN_SIZE = 10000
+    # Approximate search (FAISS or int8) shortlists this many times top_k for final scoring
+    SHORTLIST_FACTOR = 4
+    # Rows upcast at a time when scoring reduced-precision embeddings
+    SCORE_TILE_ROWS = 4096
+    # Maximum deviation from unit norm for embeddings to be used without renormalizing
+    UNIT_NORM_TOLERANCE = 1e-6
+    
     def __init__(self, embedder: EmbeddingModel):
         self.embedder = embedder
         self.promotions: List[Dict[str, Any]] = []
         self.embeddings: Optional[np.ndarray] = None
+        self._normed: Optional[np.ndarray] = None  # L2-normalized embeddings used for scoring
+        self._scales: Optional[np.ndarray] = None  # per-row dequantization scales for int8 storage
+        self._norms: Optional[np.ndarray] = None  # float32 embedding norms for exact int8 re-scoring
+        # float16 halves and int8 quarters the memory scanned per query; scores are still float32
+        self.storage_dtype = np.dtype(os.getenv("EMBEDDING_STORAGE_DTYPE", "float32"))
         self.index_built = False
+        # Bumped whenever search results may change, so callers can key result caches on it
+        self.generation = 0
+        
+        # Promotion metadata as arrays for vectorized profile boosting
+        self._category_vocab: Dict[str, int] = {}
+        self._category_matrix: Optional[np.ndarray] = None  # (N, C) category membership
+        self._price_tiers: Optional[np.ndarray] = None  # (N,) price tier codes, -1 if unknown
+        
+        # Optional BM25 first stage: only the top-k lexical matches are scored semantically
+        self.lexical_prefilter_k = int(os.getenv("BM25_PREFILTER_K", "0"))
+        self.lexical_index = BM25Index()
+        
+        # Optional FAISS approximate nearest neighbour index (SEARCH_BACKEND=faiss)
+        self.search_backend = os.getenv("SEARCH_BACKEND", "numpy").lower()
+        self.faiss_factory = os.getenv("FAISS_INDEX_FACTORY", "IVF64,PQ16")
+        self.faiss_nprobe = int(os.getenv("FAISS_NPROBE", "8"))
+        self._ann_index = None
+        
+        # LRU of normalized query embeddings, so repeated queries skip the encoder
+        query_cache_size = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+        self._encode_query = functools.lru_cache(maxsize=query_cache_size)(self._encode_query_uncached)
     
     def add_promotions(self, promotions: List[Dict[str, Any]]):
         """Add promotions to the index."""
         self.promotions.extend(promotions)
         self.index_built = False
+        self.generation += 1
         logger.info(f"Added {len(promotions)} promotions to index")
     
     def build_index(self, force_rebuild: bool = False):
         """Build the embedding index for all promotions."""
         if self.index_built and not force_rebuild:
             return
+        if force_rebuild:
+            self.generation += 1
         
         if not self.promotions:
             logger.warning("No promotions to index")
             return
         
-        # Try to load cached embeddings
-        cached_embeddings = self.embedder.load_embeddings("promotion_embeddings")
-        if cached_embeddings is not None and len(cached_embeddings) == len(self.promotions) and not force_rebuild:
-            self.embeddings = cached_embeddings
-            self.index_built = True
-            logger.info("Using cached promotion embeddings")
-            return
+        self._build_metadata_arrays()
         
-        # Build embeddings
+        texts = [self._promotion_text(promo) for promo in self.promotions]
+        if self.lexical_prefilter_k > 0:
+            self.lexical_index.build(texts)
+        
+        # Build embeddings, re-encoding only promotions whose text is not cached
         logger.info(f"Building embeddings for {len(self.promotions)} promotions")
-        texts = []
+        self.embeddings = self.embedder.encode_cached(texts, "promotion_embeddings", force_rebuild)
+        self._normalize_embeddings()
+        self._build_ann_index()
+        self.index_built = True
+        logger.info("Promotion index built successfully")
+    
+    def _build_metadata_arrays(self):
+        """Encode promotion categories and price tiers as arrays."""
+        self._category_vocab = {}
         for promo in self.promotions:
-            # Combine title and description for embedding
-            text = f"{promo.get('title', '')} {promo.get('description', '')}"
-            texts.append(text)
+            for category in promo.get('categories', []):
+                self._category_vocab.setdefault(category, len(self._category_vocab))
         
-        self.embeddings = self.embedder.encode(texts)
-        self.index_built = True
+        self._category_matrix = np.zeros((len(self.promotions), len(self._category_vocab)), dtype=np.uint8)
+        for row, promo in enumerate(self.promotions):
+            columns = [self._category_vocab[category] for category in promo.get('categories', [])]
+            self._category_matrix[row, columns] = 1
         
-        # Cache the embeddings
-        self.embedder.save_embeddings(self.embeddings, "promotion_embeddings")
-        logger.info("Promotion index built successfully")
+        self._price_tiers = np.array(
+            [self.PRICE_TIERS.get(promo.get('price_tier', 'medium'), -1) for promo in self.promotions],
+            dtype=np.int8
+        )
+    
+    def _normalize_embeddings(self):
+        """Store unit-length embeddings so cosine similarity is a single matrix-vector product."""
+        embeddings = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+        norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))[:, None]
+        self._scales = None
+        self._norms = None
+        
+        # Already-normalized float32 embeddings (e.g. a memory-mapped cache) are scored in place,
+        # so their pages stay shared with the page cache instead of being copied to the heap
+        if self.storage_dtype == np.float32 and np.allclose(norms, 1.0, rtol=0.0, atol=self.UNIT_NORM_TOLERANCE):
+            self._normed = embeddings
+            return
+        
+        normed = embeddings / np.maximum(norms, 1e-12)
+        if self.storage_dtype == np.int8:
+            self._normed, self._scales = _quantize_int8(normed)
+            self._norms = np.maximum(norms[:, 0], 1e-12)
+        else:
+            self._normed = normed.astype(self.storage_dtype, copy=False)
+    
+    def _build_ann_index(self):
+        """Build the FAISS index over normalized embeddings when that backend is enabled."""
+        self._ann_index = None
+        if self.search_backend != "faiss":
+            return
+        if not FAISS_AVAILABLE:
+            logger.warning("FAISS not available, using exact NumPy search")
+            return
+        
+        # An exact (Flat) FAISS index would only repeat the NumPy full scan, while its
+        # shortlist could drop promotions that profile boosts lift into the top_k
+        if self.faiss_factory == "Flat" or len(self._normed) < self.FAISS_MIN_TRAIN_SIZE:
+            logger.info("Catalog too small for approximate FAISS search, using exact NumPy search")
+            return
+        
+        factory = self.faiss_factory
+        # FAISS keeps its own copy, so give it full-precision vectors whatever the storage dtype
+        vectors = self._normed
+        if vectors.dtype != np.float32:
+            vectors = np.asarray(self.embeddings, dtype=np.float32)
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        index = faiss.index_factory(vectors.shape[1], factory, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        try:
+            faiss.extract_index_ivf(index).nprobe = self.faiss_nprobe
+        except RuntimeError:
+            pass  # Not an IVF index
+        
+        self._ann_index = index
+        logger.info(f"FAISS index built: {factory}, {index.ntotal} vectors")
+    
+    @staticmethod
+    def _promotion_text(promo: Dict[str, Any]) -> str:
+        """Combine title and description for indexing."""
+        return f"{promo.get('title', '')} {promo.get('description', '')}"
     
     def search(self, query: str, top_k: int = 10, user_profile: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
@@ -157,7 +552,7 @@ class PromotionIndex:
             user_profile: User profile for personalization
             
         Returns:
-            List of promotion results with scores
+            List of results with the promotion's id, title, description, link and score
         """
         if not self.index_built:
             self.build_index()
@@ -165,50 +560,161 @@ class PromotionIndex:
         if not self.promotions or self.embeddings is None:
             return []
         
-        # Encode query
-        query_embedding = self.embedder.encode([query])[0]
+        query_embedding = self._encode_query(query.strip())
         
-        # Calculate similarities
-        similarities = []
-        for i, promo_embedding in enumerate(self.embeddings):
-            similarity = self.embedder.similarity(query_embedding, promo_embedding)
-            
-            # Apply user profile boosting
-            if user_profile:
-                similarity = self._apply_user_profile_boost(similarity, self.promotions[i], user_profile)
-            
-            similarities.append((similarity, i))
+        candidate_indices, scores = self._score_candidates(query, query_embedding, top_k, user_profile)
         
-        # Sort by similarity and return top_k
-        similarities.sort(reverse=True)
-        results = []
+        # Partially select the top_k scores, then order only those
+        k = min(top_k, scores.shape[0])
+        if k <= 0:
+            return []
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(-scores[top], kind="stable")]
         
-        for similarity, idx in similarities[:top_k]:
-            promo = self.promotions[idx].copy()
-            promo['score'] = float(similarity)
-            results.append(promo)
+        results = []
+        for idx, similarity in zip(candidate_indices[top].tolist(), scores[top].tolist()):
+            promo = self.promotions[idx]
+            results.append({
+                'id': promo.get('id', ''),
+                'title': promo.get('title', ''),
+                'description': promo.get('description', ''),
+                'link': promo.get('link', ''),
+                'score': similarity
+            })
         
         return results
     
-    def _apply_user_profile_boost(self, base_score: float, promotion: Dict[str, Any], user_profile: Dict[str, Any]) -> float:
-        """Apply user profile-based boosting to the similarity score."""
-        boosted_score = base_score
+    def _encode_query_uncached(self, query: str) -> np.ndarray:
+        """Encode and L2-normalize a query; the result is read-only as it is shared via the LRU."""
+        query_embedding = self.embedder.encode([query])[0].astype(np.float32)
+        query_embedding /= max(np.linalg.norm(query_embedding), 1e-12)
+        query_embedding.setflags(write=False)
+        return query_embedding
+    
+    def _score_candidates(self, query: str, query_embedding: np.ndarray, top_k: int,
+                          user_profile: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Select candidate promotions and their cosine similarities to the query plus profile boosts.
+        
+        Returns:
+            Tuple of (promotion indices, boosted similarity scores)
+        """
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        # Restrict semantic scoring to lexical matches when the catalog is large
+        candidate_indices = None
+        if 0 < self.lexical_prefilter_k < len(self.promotions):
+            lexical_matches = self.lexical_index.retrieve(query, self.lexical_prefilter_k)
+            if len(lexical_matches) > 0:
+                candidate_indices = lexical_matches
+        
+        # Approximate shortlist from FAISS, leaving room for profile boosts to reorder
+        if candidate_indices is None and self._ann_index is not None:
+            shortlist = min(len(self.promotions), top_k * self.SHORTLIST_FACTOR)
+            distances, ids = self._ann_index.search(query_embedding[None, :], shortlist)
+            found = ids[0] >= 0
+            candidate_indices = ids[0][found]
+            return candidate_indices, self._boosted(distances[0][found], self._profile_boost(candidate_indices, user_profile))
+        
+        if candidate_indices is None:
+            # Cosine similarities of all promotions in a single matrix-vector product
+            candidate_indices = np.arange(len(self.promotions))
+            scores = self._similarities(self._normed, query_embedding, self._scales)
+        else:
+            scales = self._scales[candidate_indices] if self._scales is not None else None
+            scores = self._similarities(self._normed[candidate_indices], query_embedding, scales)
+        
+        boost = self._profile_boost(candidate_indices, user_profile)
+        
+        # int8 scores only shortlist candidates; the final scores come from the float32 embeddings
+        if self._scales is not None:
+            return self._rescore_shortlist(candidate_indices, scores, boost, query_embedding, top_k)
+        return candidate_indices, self._boosted(scores, boost)
+    
+    def _rescore_shortlist(self, candidate_indices: np.ndarray, scores: np.ndarray, boost: Optional[np.ndarray],
+                           query_embedding: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Keep the best approximately scored candidates and score them exactly in float32.
+        
+        The shortlist is taken on boosted scores, so promotions the profile lifts
+        into the top_k are re-scored rather than cut on their raw similarity.
+        """
+        shortlist = min(len(scores), top_k * self.SHORTLIST_FACTOR)
+        if shortlist <= 0:
+            return candidate_indices[:0], scores[:0]
+        
+        positions = np.argpartition(self._boosted(scores, boost), -shortlist)[-shortlist:]
+        ids = candidate_indices[positions]
+        rows = np.asarray(self.embeddings[ids], dtype=np.float32)
+        exact = (rows @ query_embedding) / self._norms[ids]
+        return ids, self._boosted(exact, boost[positions] if boost is not None else None)
+    
+    def _profile_boost(self, candidate_indices: np.ndarray,
+                       user_profile: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Profile boost per candidate; null and empty profiles boost nothing."""
+        return self._user_profile_boost(candidate_indices, user_profile) if user_profile else None
+    
+    @staticmethod
+    def _boosted(scores: np.ndarray, boost: Optional[np.ndarray]) -> np.ndarray:
+        """Add a profile boost to similarity scores, capped at 1."""
+        return scores if boost is None else np.minimum(scores + boost, 1.0)
+    
+    def _similarities(self, embeddings: np.ndarray, query_embedding: np.ndarray,
+                      scales: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Dot products of normalized embeddings with the query, computed in float32.
+        
+        int8 embeddings are dequantized with their per-row scales.
+        """
+        if embeddings.dtype == np.float32:
+            return embeddings @ query_embedding
+        
+        if SIMSIMD_AVAILABLE and len(embeddings) > 0:
+            # SimSIMD reads reduced-precision rows directly, without upcast copies
+            if embeddings.dtype == np.int8:
+                query, query_scale = _quantize_int8(query_embedding[None, :])
+            else:
+                query, query_scale = query_embedding.astype(embeddings.dtype)[None, :], 1.0
+            scores = simsimd.cdist(query, np.ascontiguousarray(embeddings), metric="dot")
+            scores = np.asarray(scores, dtype=np.float32)[0] * query_scale
+        else:
+            # Upcast reduced-precision rows tile by tile so the product still runs in float32 BLAS
+            scores = np.empty(len(embeddings), dtype=np.float32)
+            for start in range(0, len(embeddings), self.SCORE_TILE_ROWS):
+                tile = embeddings[start:start + self.SCORE_TILE_ROWS]
+                scores[start:start + self.SCORE_TILE_ROWS] = tile.astype(np.float32) @ query_embedding
+        
+        if scales is not None:
+            scores *= scales
+        return scores
+    
+    def _user_profile_boost(self, candidate_indices: np.ndarray, user_profile: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        Compute user profile-based score boosts for the candidate promotions.
+        
+        Returns:
+            Boost per candidate, or None when the profile matches nothing to boost
+        """
+        interest_columns = [self._category_vocab[i] for i in set(user_profile.get('interests', []))
+                            if i in self._category_vocab]
+        user_tier = self.PRICE_TIERS.get(user_profile.get('budget_level', 'medium'))
+        if not interest_columns and user_tier is None:
+            return None
         
-        # Interest matching boost
-        user_interests = set(user_profile.get('interests', []))
-        promo_categories = set(promotion.get('categories', []))
-        interest_overlap = len(user_interests & promo_categories)
-        if interest_overlap > 0:
-            boosted_score += 0.1 * interest_overlap
+        boost = np.zeros(len(candidate_indices), dtype=np.float32)
         
-        # Budget level matching
-        user_budget = user_profile.get('budget_level', 'medium')
-        promo_price_tier = promotion.get('price_tier', 'medium')
+        # Interest matching boost: 0.1 per overlapping category
+        if interest_columns:
+            interests = np.zeros(len(self._category_vocab), dtype=np.uint8)
+            interests[interest_columns] = 1
+            boost += 0.1 * (self._category_matrix[candidate_indices] @ interests)
         
-        if user_budget == promo_price_tier:
-            boosted_score += 0.05
-        elif (user_budget == 'high' and promo_price_tier == 'medium') or \
-             (user_budget == 'medium' and promo_price_tier == 'low'):
-            boosted_score += 0.02
+        # Budget level matching: exact tier, or one tier below a medium/high budget
+        if user_tier is not None:
+            price_tiers = self._price_tiers[candidate_indices]
+            boost[price_tiers == user_tier] += np.float32(0.05)
+            if user_tier > 0:
+                boost[price_tiers == user_tier - 1] += np.float32(0.02)
         
-        return min(boosted_score, 1.0)  # Cap at 1.0
+        return boost
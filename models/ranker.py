@@ -3,8 +3,9 @@ Ranking model for CTR/CVR prediction and promotion scoring.
 """
 
 import os
+import zlib
 import numpy as np
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from loguru import logger
 
 try:
@@ -14,10 +15,124 @@ except ImportError:
     LIGHTGBM_AVAILABLE = False
     logger.warning("LightGBM not available, using mock ranking model")
 
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, parallel=True)
+    def _linear_score_kernel(features: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Weighted sum of each feature row, parallelized over candidates."""
+        scores = np.empty(features.shape[0])
+        for i in prange(features.shape[0]):
+            score = 0.0
+            for j in range(features.shape[1]):
+                score += features[i, j] * weights[j]
+            scores[i] = score
+        return scores
+    
+    @njit(cache=True)
+    def _worse(score_a: float, index_a: int, score_b: float, index_b: int) -> bool:
+        """Whether candidate a ranks below b: lower score, or same score but later position."""
+        return score_a < score_b or (score_a == score_b and index_a > index_b)
+    
+    @njit(cache=True)
+    def _sift_down(heap_scores: np.ndarray, heap_indices: np.ndarray, size: int, pos: int):
+        """Restore the worst-on-top heap property below pos."""
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                return
+            if child + 1 < size and _worse(heap_scores[child + 1], heap_indices[child + 1],
+                                           heap_scores[child], heap_indices[child]):
+                child += 1
+            if not _worse(heap_scores[child], heap_indices[child], heap_scores[pos], heap_indices[pos]):
+                return
+            heap_scores[pos], heap_scores[child] = heap_scores[child], heap_scores[pos]
+            heap_indices[pos], heap_indices[child] = heap_indices[child], heap_indices[pos]
+            pos = child
+    
+    @njit(cache=True)
+    def _top_k_kernel(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k best scores, best first, using a size-k heap with the worst on top."""
+        heap_scores = scores[:k].copy()
+        heap_indices = np.arange(k)
+        for pos in range(k // 2 - 1, -1, -1):
+            _sift_down(heap_scores, heap_indices, k, pos)
+        
+        for i in range(k, scores.shape[0]):
+            if _worse(heap_scores[0], heap_indices[0], scores[i], i):
+                heap_scores[0] = scores[i]
+                heap_indices[0] = i
+                _sift_down(heap_scores, heap_indices, k, 0)
+        
+        # Pop the worst remaining candidate into the last free slot
+        order = np.empty(k, dtype=np.int64)
+        for size in range(k, 0, -1):
+            order[size - 1] = heap_indices[0]
+            heap_scores[0] = heap_scores[size - 1]
+            heap_indices[0] = heap_indices[size - 1]
+            _sift_down(heap_scores, heap_indices, size - 1, 0)
+        return order
+else:
+    def _linear_score_kernel(features: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Weighted sum of each feature row."""
+        return features @ weights
+    
+    def _top_k_kernel(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k best scores, best first, with ties kept in position order."""
+        # Everything tied with the k-th best score is kept so ties resolve by position
+        n = scores.shape[0]
+        kth_score = np.partition(scores, n - k)[n - k]
+        selected = np.flatnonzero(scores >= kth_score)
+        return selected[np.argsort(-scores[selected], kind="stable")][:k]
+
+
+# Candidate fields carried into each ranked result, so callers need no id join
+DETAIL_FIELDS = ("title", "description", "link")
+
+
+def ranked_record(candidate: Dict[str, Any], index: int, score: float) -> Dict[str, Any]:
+    """
+    Build the ranked result for a candidate.
+    
+    Args:
+        candidate: Promotion candidate the score belongs to
+        index: Position of the candidate in the input list (names id-less candidates)
+        score: Ranking score
+        
+    Returns:
+        Dictionary with the candidate's id and display fields, plus the score
+    """
+    record = {"id": candidate.get("id", f"promo_{index}")}
+    for field in DETAIL_FIELDS:
+        if field in candidate:
+            record[field] = candidate[field]
+    record["score"] = score
+    return record
+
 
 class PromotionRanker:
     """Handles ranking of promotion candidates based on CTR/CVR prediction."""
     
+    # Feature weights used by the mock model, in feature_names order
+    _MOCK_WEIGHTS = np.array([0.4, 0.3, 0.2, 0.05, 0.03, 0.02])
+    _PRICE_TIER_VALUES = {"low": 0.0, "medium": 0.5, "high": 1.0}
+    _USER_TYPE_VALUES = {"casual": 0.0, "professional": 0.5, "enterprise": 1.0}
+    
+    # Budget compatibility indexed by [user budget, promotion price tier]; the last
+    # row/column holds the neutral score for unrecognized levels
+    _TIER = {"low": 0, "medium": 1, "high": 2}
+    _COMPAT = np.array([
+        [1.0, 0.3, 0.1, 0.5],
+        [0.8, 1.0, 0.6, 0.5],
+        [0.9, 0.9, 1.0, 0.5],
+        [0.5, 0.5, 0.5, 0.5],
+    ])
+    
     def __init__(self, model_type: Optional[str] = None):
         self.model_type = model_type or os.getenv("RANKING_MODEL_TYPE", "mock")
         self.model = None
@@ -94,27 +209,42 @@ class PromotionRanker:
         self.model.save_model("models/lightgbm_ranker.txt")
         logger.info("LightGBM model trained and saved")
     
-    def rank_promotions(self, candidates: List[Dict[str, Any]], user_profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def rank_promotions(self, candidates: List[Dict[str, Any]], user_profile: Dict[str, Any],
+                        top_k: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Rank promotion candidates based on predicted CTR/CVR.
         
         Args:
             candidates: List of promotion candidates
             user_profile: User profile for personalization
+            top_k: Number of top promotions to return (all if None)
             
         Returns:
-            List of ranked promotions with scores
+            List of ranked promotions with id, title, description, link and score
         """
-        if not candidates:
-            return []
+        order, scores = self.score_promotions(candidates, user_profile, top_k)
+        return [
+            ranked_record(candidates[i], i, score)
+            for i, score in zip(order.tolist(), scores.tolist())
+        ]
+    
+    def score_promotions(self, candidates: List[Dict[str, Any]], user_profile: Dict[str, Any],
+                         top_k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score candidates and select the best ones without building result dicts.
         
-        # Extract features for each candidate
-        features = []
-        for candidate in candidates:
-            feature_vector = self._extract_features(candidate, user_profile)
-            features.append(feature_vector)
+        Args:
+            candidates: List of promotion candidates
+            user_profile: User profile for personalization
+            top_k: Number of top promotions to return (all if None)
+            
+        Returns:
+            (candidate indices best first, their float64 scores)
+        """
+        if not candidates:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
         
-        features_array = np.array(features)
+        features_array = self._extract_features(candidates, *self._user_context(user_profile))
         
         # Predict scores
         if self.model_type == "lightgbm" and self.model is not None:
@@ -122,81 +252,100 @@ class PromotionRanker:
         else:
             scores = self._mock_predict(features_array)
         
-        # Create ranked results
-        ranked_promotions = []
-        for i, (candidate, score) in enumerate(zip(candidates, scores)):
-            ranked_promotion = {
-                "id": candidate.get("id", f"promo_{i}"),
-                "score": float(score)
-            }
-            ranked_promotions.append(ranked_promotion)
-        
-        # Sort by score (descending)
-        ranked_promotions.sort(key=lambda x: x["score"], reverse=True)
+        # Select and order the top scores in NumPy
+        scores = np.asarray(scores, dtype=np.float64)
+        order = self._top_indices(scores, top_k)
+        return order, scores[order]
+    
+    @staticmethod
+    def _top_indices(scores: np.ndarray, top_k: Optional[int]) -> np.ndarray:
+        """Indices of the top_k scores (all if None), best first, ties kept in candidate order."""
+        n = len(scores)
+        if top_k is None or top_k >= n:
+            return np.argsort(-scores, kind="stable")
+        if top_k <= 0:
+            return np.empty(0, dtype=np.intp)
+        return _top_k_kernel(scores, top_k)
+    
+    def _user_context(self, user_profile: Dict[str, Any]) -> Tuple[Dict[str, int], int, float]:
+        """
+        Resolve the user-side inputs of the ranking features once per request.
         
-        return ranked_promotions
+        Returns:
+            (column index of each distinct interest, budget tier code, numeric user type)
+        """
+        interest_ids = {interest: j for j, interest in enumerate(set(user_profile.get("interests", [])))}
+        budget_code = self._tier_code(user_profile.get("budget_level", "medium"))
+        user_type_numeric = self._USER_TYPE_VALUES.get(user_profile.get("user_type", "casual"), 0.0)
+        return interest_ids, budget_code, user_type_numeric
     
-    def _extract_features(self, promotion: Dict[str, Any], user_profile: Dict[str, Any]) -> List[float]:
-        """Extract features for ranking model."""
-        features = []
+    def _extract_features(self, candidates: List[Dict[str, Any]], interest_ids: Dict[str, int],
+                          budget_code: int, user_type_numeric: float) -> np.ndarray:
+        """
+        Build the feature matrix for all candidates at once.
+        
+        Candidate fields are gathered into per-feature columns in a single pass.
+        
+        Args:
+            candidates: List of promotion candidates
+            interest_ids: Column index of each distinct user interest
+            budget_code: User budget level as a compatibility matrix index
+            user_type_numeric: User type encoded as a number
+            
+        Returns:
+            (len(candidates), len(feature_names)) float64 feature matrix
+        """
+        n = len(candidates)
+        categories = [candidate.get("categories", []) for candidate in candidates]
+        price_tiers = [candidate.get("price_tier", "medium") for candidate in candidates]
         
         # Base CTR from promotion data
-        base_ctr = promotion.get("base_ctr", 0.1)
-        features.append(base_ctr)
+        base_ctr = np.fromiter((c.get("base_ctr", 0.1) for c in candidates), dtype=np.float64, count=n)
         
-        # Interest matching score
-        user_interests = set(user_profile.get("interests", []))
-        promo_categories = set(promotion.get("categories", []))
-        interest_match = len(user_interests & promo_categories) / max(len(user_interests), 1)
-        features.append(interest_match)
+        # Interest matching score: distinct user interests covered by each promotion
+        category_counts = np.fromiter(map(len, categories), dtype=np.int64, count=n)
+        if interest_ids:
+            owners = np.repeat(np.arange(n), category_counts)
+            matched_ids = np.fromiter(
+                (interest_ids.get(category, -1) for cats in categories for category in cats),
+                dtype=np.int64, count=len(owners)
+            )
+            matched = matched_ids >= 0
+            interest_hits = np.zeros((n, len(interest_ids)), dtype=bool)
+            interest_hits[owners[matched], matched_ids[matched]] = True
+            interest_match = interest_hits.sum(axis=1) / len(interest_ids)
+        else:
+            interest_match = np.zeros(n)
         
         # Budget compatibility
-        user_budget = user_profile.get("budget_level", "medium")
-        promo_price_tier = promotion.get("price_tier", "medium")
-        budget_compat = self._calculate_budget_compatibility(user_budget, promo_price_tier)
-        features.append(budget_compat)
+        tier_codes = np.fromiter(map(self._tier_code, price_tiers), dtype=np.intp, count=n)
+        budget_compat = self._COMPAT[budget_code, tier_codes]
         
         # Category diversity (how many categories the promotion covers)
-        category_diversity = len(promotion.get("categories", [])) / 10.0  # normalize
-        features.append(category_diversity)
+        category_diversity = category_counts / 10.0  # normalize
         
         # Price tier as numeric
-        price_tier_map = {"low": 0.0, "medium": 0.5, "high": 1.0}
-        price_tier_numeric = price_tier_map.get(promo_price_tier, 0.5)
-        features.append(price_tier_numeric)
-        
-        # User type as numeric
-        user_type_map = {"casual": 0.0, "professional": 0.5, "enterprise": 1.0}
-        user_type_numeric = user_type_map.get(user_profile.get("user_type", "casual"), 0.0)
-        features.append(user_type_numeric)
-        
-        return features
-    
-    def _calculate_budget_compatibility(self, user_budget: str, promo_price_tier: str) -> float:
-        """Calculate compatibility between user budget and promotion price tier."""
-        compatibility_matrix = {
-            ("low", "low"): 1.0,
-            ("low", "medium"): 0.3,
-            ("low", "high"): 0.1,
-            ("medium", "low"): 0.8,
-            ("medium", "medium"): 1.0,
-            ("medium", "high"): 0.6,
-            ("high", "low"): 0.9,
-            ("high", "medium"): 0.9,
-            ("high", "high"): 1.0,
-        }
+        price_tier_numeric = np.fromiter(
+            (self._PRICE_TIER_VALUES.get(tier, 0.5) for tier in price_tiers), dtype=np.float64, count=n
+        )
         
-        return compatibility_matrix.get((user_budget, promo_price_tier), 0.5)
+        return np.column_stack([
+            base_ctr, interest_match, budget_compat, category_diversity,
+            price_tier_numeric, np.full(n, user_type_numeric)
+        ])
+    
+    def _tier_code(self, tier: str) -> int:
+        """Row/column of a budget level or price tier in the compatibility matrix."""
+        return self._TIER.get(tier, len(self._TIER))
     
     def _mock_predict(self, features: np.ndarray) -> np.ndarray:
         """Mock prediction when LightGBM is not available."""
         # Simple weighted combination of features
-        weights = np.array([0.4, 0.3, 0.2, 0.05, 0.03, 0.02])
-        scores = np.dot(features, weights)
+        scores = _linear_score_kernel(features, self._MOCK_WEIGHTS)
         
-        # Add some randomness
-        np.random.seed(hash(str(features.tobytes())) % 2**32)
-        noise = np.random.normal(0, 0.02, len(scores))
+        # Add some randomness, seeded from the feature buffer so rankings are reproducible
+        rng = np.random.default_rng(zlib.crc32(np.ascontiguousarray(features)))
+        noise = rng.normal(0, 0.02, len(scores))
         scores += noise
         
         # Ensure scores are in reasonable range
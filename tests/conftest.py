@@ -0,0 +1,88 @@
+"""
+Shared fixtures for PromoSearch MCP Server tests.
+"""
+
+import types
+
+import pytest
+import pytest_asyncio
+
+from mcp_server.tools.search_promotions import search_promotions_tool, _get_promotion_index
+from mcp_server.tools.rank_promotions import rank_promotions_tool
+from models.embedder import PromotionIndex
+
+# Ranking candidates shared by every test that takes the candidates fixture; read-only
+# views, so a ranker that mutated its input would fail instead of leaking state
+_CANDIDATES = tuple(types.MappingProxyType(candidate) for candidate in [
+    {
+        "id": "test-1",
+        "title": "Test Promotion 1",
+        "description": "Cloud hosting service",
+        "link": "https://example.com/1",
+        "categories": ("cloud", "hosting"),
+        "price_tier": "medium",
+        "base_ctr": 0.1
+    },
+    {
+        "id": "test-2",
+        "title": "Test Promotion 2",
+        "description": "Mobile phone deal",
+        "link": "https://example.com/2",
+        "categories": ("mobile", "phone"),
+        "price_tier": "high",
+        "base_ctr": 0.15
+    }
+])
+
+
+@pytest.fixture(scope="session")
+def candidates():
+    """Read-only promotion candidates for ranking tests."""
+    return _CANDIDATES
+
+
+@pytest.fixture(scope="session")
+def pro_profile():
+    """Read-only professional user profile shared by every test, so repeated searches hit the cache."""
+    return types.MappingProxyType({
+        "user_type": "professional",
+        "interests": ("cloud", "hosting"),
+        "budget_level": "medium"
+    })
+
+
+@pytest.fixture(scope="session")
+def casual_profile():
+    """Read-only casual user profile with no interests."""
+    return types.MappingProxyType({
+        "user_type": "casual",
+        "interests": (),
+        "budget_level": "low"
+    })
+
+
+@pytest_asyncio.fixture(scope="session")
+async def warm_search(casual_profile):
+    """Load the embedding model, build the promotion index and compile ranking kernels once per session."""
+    promotion_index = _get_promotion_index()
+    search_result = await search_promotions_tool("warmup", casual_profile)
+    await rank_promotions_tool(search_result["results"], casual_profile, top_k=1)
+    return promotion_index
+
+
+@pytest.fixture
+def make_index(warm_search, tmp_path, monkeypatch):
+    """
+    Factory for fresh promotion indexes over the session's (or the given) promotions.
+    
+    Indexes share the warm embedder, with its embedding cache redirected to a
+    temporary directory; set index env vars before calling the factory.
+    """
+    monkeypatch.setattr(warm_search.embedder, "cache_path", str(tmp_path))
+    
+    def make(promotions=None):
+        promotion_index = PromotionIndex(warm_search.embedder)
+        promotion_index.add_promotions(list(warm_search.promotions if promotions is None else promotions))
+        return promotion_index
+    
+    return make
@@ -0,0 +1,232 @@
+"""
+Tests for the PromoSearch retrieval models.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from models.bm25_index import BM25Index
+
+
+class TestBM25Index:
+    """Test the lexical first-stage retriever."""
+    
+    @pytest.fixture
+    def bm25(self):
+        """Index over a tiny corpus."""
+        index = BM25Index()
+        index.build([
+            "cloud hosting deal",
+            "gaming laptop sale",
+            "cloud cloud storage",
+            "phone bundle"
+        ])
+        return index
+    
+    def test_retrieve_ranks_by_score(self, bm25):
+        """Test that documents are ordered by BM25 score and non-matches are dropped."""
+        assert bm25.retrieve("cloud", 10).tolist() == [2, 0]
+        assert bm25.retrieve("cloud hosting", 10).tolist() == [0, 2]
+    
+    def test_retrieve_truncates_to_k(self, bm25):
+        """Test that only the k best matches are returned."""
+        assert bm25.retrieve("cloud laptop phone", 2).tolist() == bm25.retrieve("cloud laptop phone", 10).tolist()[:2]
+        assert len(bm25.retrieve("cloud laptop phone", 10)) == 4
+    
+    @pytest.mark.parametrize("query", ["", "kayak", "a", "我想找云主机优惠"])
+    def test_retrieve_no_matching_tokens(self, bm25, query):
+        """Test that queries without indexed tokens match nothing."""
+        assert bm25.retrieve(query, 10).tolist() == []
+    
+    def test_retrieve_before_build(self):
+        """Test that an unbuilt index matches nothing."""
+        assert BM25Index().retrieve("cloud", 10).tolist() == []
+    
+    def test_promotion_index_falls_back_to_full_scan(self, make_index, monkeypatch):
+        """Test that a query with no lexical matches is scored against every promotion."""
+        full_scan = make_index()
+        monkeypatch.setenv("BM25_PREFILTER_K", "2")
+        prefiltered = make_index()
+        
+        # Lexical matches cap the candidates, so the prefilter is active
+        assert len(prefiltered.search("cloud hosting", top_k=5)) == 2
+        
+        query = "我想找云主机优惠"
+        results = prefiltered.search(query, top_k=5)
+        
+        assert prefiltered.lexical_index.retrieve(query, 2).tolist() == []
+        assert len(results) == 5
+        assert results == full_scan.search(query, top_k=5)
+
+
+class TestEmbeddingCache:
+    """Test the content-addressed embedding cache."""
+    
+    def test_encode_cached_encodes_only_new_texts(self, warm_search, tmp_path, monkeypatch):
+        """Test that a rebuild encodes only added texts and returns rows in the new text order."""
+        embedder = warm_search.embedder
+        monkeypatch.setattr(embedder, "cache_path", str(tmp_path))
+        
+        encoded = []
+        encode = embedder.encode
+        
+        def counting_encode(texts):
+            encoded.append(list(texts))
+            return encode(texts)
+        
+        monkeypatch.setattr(embedder, "encode", counting_encode)
+        
+        first_texts = ["cloud hosting deal", "gaming laptop sale", "phone bundle"]
+        second_texts = ["phone bundle", "vpn privacy offer", "cloud hosting deal", "gaming laptop sale"]
+        
+        first = embedder.encode_cached(first_texts, "test_embeddings")
+        second = embedder.encode_cached(second_texts, "test_embeddings")
+        third = embedder.encode_cached(second_texts, "test_embeddings")
+        
+        assert encoded == [first_texts, ["vpn privacy offer"]]
+        np.testing.assert_allclose(second, encode(second_texts), rtol=0, atol=1e-6)
+        np.testing.assert_array_equal(second[[2, 3, 0]], first)
+        np.testing.assert_array_equal(third, second)
+
+
+def _synthetic_catalog(size: int, seed: int = 0):
+    """Promotions with random categories and price tiers, so profile boosts reorder results."""
+    rng = random.Random(seed)
+    categories = ["cloud", "hosting", "gaming", "phone", "vpn", "ai", "storage", "web"]
+    return [
+        {
+            "id": f"synthetic-{i}",
+            "title": f"Synthetic promotion {i}",
+            "description": f"Offer number {i}",
+            "categories": rng.sample(categories, rng.randint(0, 3)),
+            "price_tier": rng.choice(["low", "medium", "high"])
+        }
+        for i in range(size)
+    ]
+
+
+PROFILES = [
+    {"interests": ["cloud", "vpn"], "budget_level": "low"},
+    {"interests": ["gaming", "ai"], "budget_level": "high"},
+    {"interests": ["web", "storage"], "budget_level": "medium"},
+]
+
+
+class TestReducedPrecisionStorage:
+    """Test that reduced-precision embedding storage ranks like float32."""
+    
+    QUERIES = ["cloud hosting", "gaming laptop", "我想找AWS云主机优惠", "vpn"]
+    
+    @pytest.mark.parametrize("use_simsimd", [True, False])
+    @pytest.mark.parametrize("prefilter_k", ["0", "5"])
+    @pytest.mark.parametrize("dtype", ["float16", "int8"])
+    def test_matches_float32(self, make_index, monkeypatch, dtype, prefilter_k, use_simsimd):
+        """Test full-scan and BM25-subset scoring, with and without SimSIMD."""
+        from models import embedder
+        
+        monkeypatch.setenv("BM25_PREFILTER_K", prefilter_k)
+        reference = make_index()
+        monkeypatch.setenv("EMBEDDING_STORAGE_DTYPE", dtype)
+        reduced = make_index()
+        if not use_simsimd:
+            monkeypatch.setattr(embedder, "SIMSIMD_AVAILABLE", False)
+        
+        profile = {"interests": ["cloud"], "budget_level": "medium"}
+        for query in self.QUERIES:
+            expected = reference.search(query, top_k=5, user_profile=profile)
+            actual = reduced.search(query, top_k=5, user_profile=profile)
+            exact = {
+                promo["id"]: promo["score"]
+                for promo in reference.search(query, top_k=len(reference.promotions), user_profile=profile)
+            }
+            
+            # Rounding may swap promotions whose exact scores tie within the tolerance,
+            # so compare scores by rank and each returned promotion against its exact score
+            np.testing.assert_allclose(
+                [promo["score"] for promo in actual],
+                [promo["score"] for promo in expected],
+                rtol=0, atol=2e-3
+            )
+            np.testing.assert_allclose(
+                [promo["score"] for promo in actual],
+                [exact[promo["id"]] for promo in actual],
+                rtol=0, atol=2e-3
+            )
+        
+        assert reduced._normed.dtype == np.dtype(dtype)
+    
+    @pytest.mark.parametrize("top_k", [1, 2, 3])
+    def test_int8_shortlist_keeps_boosted_promotions(self, make_index, monkeypatch, top_k):
+        """Test that profile boosts apply before the int8 shortlist, which here is a fraction of the catalog."""
+        catalog = _synthetic_catalog(60)
+        reference = make_index(catalog)
+        monkeypatch.setenv("EMBEDDING_STORAGE_DTYPE", "int8")
+        reduced = make_index(catalog)
+        assert top_k * reduced.SHORTLIST_FACTOR < len(catalog) // 4
+        
+        for profile in PROFILES:
+            for query in self.QUERIES:
+                expected = reference.search(query, top_k=top_k, user_profile=profile)
+                actual = reduced.search(query, top_k=top_k, user_profile=profile)
+                
+                assert [promo["id"] for promo in actual] == [promo["id"] for promo in expected]
+                np.testing.assert_allclose(
+                    [promo["score"] for promo in actual],
+                    [promo["score"] for promo in expected],
+                    rtol=0, atol=1e-5
+                )
+
+
+class TestSearchBackends:
+    """Test that the search backends agree."""
+    
+    @pytest.mark.parametrize("top_k", [1, 3])
+    def test_faiss_backend_matches_numpy_with_profile(self, make_index, monkeypatch, top_k):
+        """Test that profiled FAISS-backend searches on a small catalog match the NumPy backend."""
+        catalog = _synthetic_catalog(60)
+        reference = make_index(catalog)
+        monkeypatch.setenv("SEARCH_BACKEND", "faiss")
+        faiss_backed = make_index(catalog)
+        
+        for profile in PROFILES:
+            for query in ["cloud hosting", "gaming laptop", "vpn"]:
+                assert faiss_backed.search(query, top_k=top_k, user_profile=profile) == \
+                    reference.search(query, top_k=top_k, user_profile=profile)
+    
+    @pytest.mark.parametrize("backend", ["numpy", "faiss"])
+    def test_non_positive_top_k_returns_nothing(self, make_index, monkeypatch, backend):
+        """Test that top_k <= 0 returns no results on every backend."""
+        monkeypatch.setenv("SEARCH_BACKEND", backend)
+        promotion_index = make_index()
+        
+        assert promotion_index.search("cloud hosting", top_k=0) == []
+        assert promotion_index.search("cloud hosting", top_k=-1) == []
+
+
+class TestMockEmbeddings:
+    """Test the hash-seeded mock embeddings used when no model is installed."""
+    
+    def test_numba_kernel_matches_numpy_fallback(self, warm_search, monkeypatch):
+        """Test that the JIT-compiled kernel and the NumPy fallback produce the same vectors."""
+        from models import embedder
+        
+        if not embedder.NUMBA_AVAILABLE:
+            pytest.skip("numba is not installed")
+        
+        texts = ["cloud hosting", "Cloud Hosting", "gaming laptop", "我想找AWS云主机优惠", ""]
+        seeds = np.array([0, 1, 0xFFFFFFFF, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64)
+        
+        jit_out = np.empty((len(seeds), embedder.MOCK_EMBEDDING_DIM))
+        numpy_out = np.empty_like(jit_out)
+        embedder._mock_embedding_kernel(seeds, jit_out)
+        embedder._mock_embedding_kernel_numpy(seeds, numpy_out)
+        np.testing.assert_allclose(jit_out, numpy_out, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(np.linalg.norm(jit_out, axis=1), 1.0, rtol=0, atol=1e-12)
+        
+        jit_embeddings = warm_search.embedder._mock_embeddings(texts)
+        monkeypatch.setattr(embedder, "_mock_embedding_kernel", embedder._mock_embedding_kernel_numpy)
+        numpy_embeddings = warm_search.embedder._mock_embeddings(texts)
+        np.testing.assert_allclose(jit_embeddings, numpy_embeddings, rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(jit_embeddings[0], jit_embeddings[1])
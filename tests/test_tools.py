@@ -2,8 +2,13 @@
 Basic tests for PromoSearch MCP Server tools.
 """
 
+import sys
+import types
 import pytest
 import asyncio
+import json
+import numpy as np
+from collections import ChainMap
 from typing import Dict, Any
 
 # Import the tool functions
@@ -11,47 +16,248 @@ from mcp_server.tools.expand_query import expand_query_tool
 from mcp_server.tools.search_promotions import search_promotions_tool
 from mcp_server.tools.rank_promotions import rank_promotions_tool
 from mcp_server.tools.optimize_ad_slots import optimize_ad_slots_tool
+from mcp_server.tools.batch_execute import batch_execute_tool
+from models.embedder import PromotionIndex
+
+
+@pytest.mark.usefixtures("warm_search")
+class TestToolResponseShapes:
+    """Test that each tool returns its results as a list under the expected key."""
+    
+    @pytest.mark.parametrize("tool,args,key,non_empty", [
+        (expand_query_tool, ("cloud hosting",), "expanded_queries", True),
+        (expand_query_tool, ("我想找AWS云主机优惠",), "expanded_queries", True),
+        (search_promotions_tool, ("cloud hosting", {
+            "user_type": "professional",
+            "interests": ["cloud", "hosting"],
+            "budget_level": "medium"
+        }), "results", False),
+        (search_promotions_tool, ("", {
+            "user_type": "casual",
+            "interests": [],
+            "budget_level": "low"
+        }), "results", False),
+        (rank_promotions_tool, ([], {
+            "user_type": "casual",
+            "interests": [],
+            "budget_level": "low"
+        }), "ranked_promotions", False),
+        (optimize_ad_slots_tool, ([], [{
+            "id": "test-promo",
+            "title": "Test Promotion",
+            "description": "Test description",
+            "link": "https://example.com"
+        }]), "injected_results", False),
+    ])
+    async def test_tool_shape(self, tool, args, key, non_empty):
+        """Test the response shape of a tool call."""
+        result = await tool(*args)
+        
+        assert key in result
+        assert isinstance(result[key], list)
+        if non_empty:
+            assert len(result[key]) > 0
 
 
 class TestExpandQuery:
     """Test query expansion functionality."""
     
-    @pytest.mark.asyncio
     async def test_expand_query_basic(self):
-        """Test basic query expansion."""
+        """Test that the original query is kept among the expansions."""
         result = await expand_query_tool("cloud hosting")
         
-        assert "expanded_queries" in result
-        assert isinstance(result["expanded_queries"], list)
-        assert len(result["expanded_queries"]) > 0
         assert "cloud hosting" in result["expanded_queries"]  # Original should be included
     
-    @pytest.mark.asyncio
-    async def test_expand_query_chinese(self):
-        """Test query expansion with Chinese text."""
-        result = await expand_query_tool("我想找AWS云主机优惠")
-        
-        assert "expanded_queries" in result
-        assert isinstance(result["expanded_queries"], list)
-        assert len(result["expanded_queries"]) > 0
+    async def test_expand_query_cached(self, monkeypatch):
+        """Test that repeated queries reuse the cached LLM expansion."""
+        from mcp_server.tools import expand_query
+        
+        calls = []
+        
+        async def fake_expand(prompt):
+            calls.append(prompt)
+            return ["cached variation"]
+        
+        monkeypatch.setenv("DEFAULT_LLM_PROVIDER", "openai")
+        monkeypatch.setattr(expand_query, "OPENAI_AVAILABLE", True)
+        monkeypatch.setattr(expand_query, "_expand_with_openai", fake_expand)
+        expand_query._expand_with_llm.cache_clear()
+        
+        first = await expand_query_tool("GPU servers")
+        second = await expand_query_tool("  gpu servers ")
+        
+        assert first == second == {"expanded_queries": ["cached variation"]}
+        assert len(calls) == 1
+    
+    async def test_expand_query_concurrent_share_llm_call(self, monkeypatch):
+        """Test that concurrent identical queries wait for a single LLM call."""
+        from mcp_server.tools import expand_query
+        
+        calls = []
+        
+        async def slow_expand(prompt):
+            calls.append(prompt)
+            await asyncio.sleep(0.01)
+            return ["shared variation"]
+        
+        monkeypatch.setenv("DEFAULT_LLM_PROVIDER", "openai")
+        monkeypatch.setattr(expand_query, "OPENAI_AVAILABLE", True)
+        monkeypatch.setattr(expand_query, "_expand_with_openai", slow_expand)
+        expand_query._expand_with_llm.cache_clear()
+        
+        results = await asyncio.gather(*(expand_query_tool("vpn service") for _ in range(3)))
+        
+        assert all(result == {"expanded_queries": ["shared variation"]} for result in results)
+        assert len(calls) == 1
+    
+    async def test_expand_query_trivial_skips_llm(self, monkeypatch):
+        """Test that very short queries never reach the LLM provider."""
+        from mcp_server.tools import expand_query
+        
+        async def fail_expand(prompt):
+            raise AssertionError("LLM should not be called")
+        
+        monkeypatch.setenv("DEFAULT_LLM_PROVIDER", "openai")
+        monkeypatch.setattr(expand_query, "OPENAI_AVAILABLE", True)
+        monkeypatch.setattr(expand_query, "_expand_with_openai", fail_expand)
+        
+        result = await expand_query_tool(" pc ")
+        
+        assert result["expanded_queries"][0] == "pc"
 
+    
+    @pytest.fixture
+    def streamed_openai(self, monkeypatch):
+        """Route OpenAI expansion through a fake client streaming the given content chunks."""
+        from mcp_server.tools import expand_query
+        
+        class FakeStream:
+            def __init__(self, chunks):
+                self.chunks = chunks
+                self.consumed = 0
+                self.closed = False
+            
+            def __aiter__(self):
+                return self
+            
+            async def __anext__(self):
+                if self.consumed == len(self.chunks):
+                    raise StopAsyncIteration
+                content = self.chunks[self.consumed]
+                self.consumed += 1
+                choices = [] if content is None else [types.SimpleNamespace(delta=types.SimpleNamespace(content=content))]
+                return types.SimpleNamespace(choices=choices)
+            
+            async def close(self):
+                self.closed = True
+        
+        def stream_chunks(chunks):
+            stream = FakeStream(chunks)
+            
+            async def create(**kwargs):
+                assert kwargs["stream"] is True
+                return stream
+            
+            client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+            monkeypatch.setattr(expand_query, "_get_openai_client", lambda: client)
+            return stream
+        
+        monkeypatch.setenv("DEFAULT_LLM_PROVIDER", "openai")
+        monkeypatch.setattr(expand_query, "OPENAI_AVAILABLE", True)
+        expand_query._expand_with_llm.cache_clear()
+        return stream_chunks
+    
+    async def test_expand_query_streamed_json(self, streamed_openai):
+        """Test that a JSON response split across stream chunks parses and stops the stream early."""
+        stream = streamed_openai([
+            None, '{"que', 'ries": ["cloud', ' hosting deal", "vps', ' sale"', ']', '}', ' ignored'
+        ])
+        
+        result = await expand_query_tool("cheap cloud hosting")
+        
+        assert result == {"expanded_queries": ["cloud hosting deal", "vps sale"]}
+        assert stream.consumed == 6
+        assert stream.closed
+    
+    async def test_expand_query_streamed_malformed_json(self, streamed_openai):
+        """Test that malformed streamed JSON falls back to rule-based expansion."""
+        from mcp_server.tools.expand_query import _fallback_expansion
+        
+        stream = streamed_openai(['{"queries": ["cloud hosting deal",', ' vps sale]', '}'])
+        
+        result = await expand_query_tool("cheap cloud hosting")
+        
+        assert result == {"expanded_queries": _fallback_expansion("cheap cloud hosting")}
+        assert stream.consumed == 3
+        assert stream.closed
+    
+    @pytest.mark.parametrize("subject,category_expansion", [
+        # Whole-token matches
+        ("cloud", "{query} cloud computing"),
+        ("aws hosting", "{query} cloud computing"),
+        ("mobile", "{query} smartphone deal"),
+        ("pc", "{query} computer deal"),
+        # Plural tokens match their singular term
+        ("servers", "{query} cloud computing"),
+        ("phones", "{query} smartphone deal"),
+        ("laptops", "{query} computer deal"),
+        # Terms inside longer words no longer match, unlike the old substring rules
+        ("cloudflare", "best {query} deals"),
+        ("webserver", "best {query} deals"),
+        ("iphone", "best {query} deals"),
+    ])
+    def test_fallback_expansion_category_matching(self, subject, category_expansion):
+        """Test that rule-based expansion picks its category from whole query tokens."""
+        from mcp_server.tools.expand_query import _fallback_expansion
+        
+        # Three promo terms in the query leave room for the category expansion in the top five
+        query = f"{subject} deal discount sale"
+        expansions = _fallback_expansion(query)
+        
+        assert expansions[0] == query
+        assert expansions[-1] == category_expansion.format(query=query)
 
+class TestAsyncLruCache:
+    """Test the coroutine cache shared by the tools."""
+    
+    async def test_waiters_share_one_call_after_failure(self):
+        """Test that a failed call hands over to its waiter without a third caller running alongside."""
+        from mcp_server.tools._cache import async_lru_cache
+        
+        calls = []
+        running = []
+        
+        @async_lru_cache(maxsize=4)
+        async def flaky(value):
+            running.append(value)
+            assert len(running) == 1, "calls for the same key overlapped"
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            running.pop()
+            if len(calls) == 1:
+                raise RuntimeError("first call fails")
+            return value
+        
+        owner = asyncio.create_task(flaky("x"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flaky("x"))
+        await asyncio.sleep(0)
+        
+        with pytest.raises(RuntimeError):
+            await owner
+        latecomer = await flaky("x")
+        
+        assert await waiter == latecomer == "x"
+        assert len(calls) == 2
+
+
+@pytest.mark.usefixtures("warm_search")
 class TestSearchPromotions:
     """Test semantic search functionality."""
     
-    @pytest.mark.asyncio
-    async def test_search_promotions_basic(self):
+    async def test_search_promotions_basic(self, pro_profile):
         """Test basic promotion search."""
-        user_profile = {
-            "user_type": "professional",
-            "interests": ["cloud", "hosting"],
-            "budget_level": "medium"
-        }
-        
-        result = await search_promotions_tool("cloud hosting", user_profile)
-        
-        assert "results" in result
-        assert isinstance(result["results"], list)
+        result = await search_promotions_tool("cloud hosting", pro_profile)
         
         if len(result["results"]) > 0:
             promotion = result["results"][0]
@@ -61,87 +267,129 @@ class TestSearchPromotions:
             assert "link" in promotion
             assert "score" in promotion
     
-    @pytest.mark.asyncio
-    async def test_search_promotions_empty_query(self):
-        """Test search with empty query."""
-        user_profile = {
-            "user_type": "casual",
-            "interests": [],
-            "budget_level": "low"
+    async def test_search_promotions_empty_query(self, casual_profile):
+        """Test that a blank query returns no results without searching."""
+        result = await search_promotions_tool("   ", casual_profile)
+        
+        assert result == {"results": []}
+    
+    async def test_search_promotions_cached(self, warm_search, pro_profile, monkeypatch):
+        """Test that repeated searches with an equal profile reuse the cached results."""
+        from mcp_server.tools import search_promotions
+        
+        calls = []
+        search = warm_search.search
+        
+        def counting_search(*args, **kwargs):
+            calls.append(kwargs["query"])
+            return search(*args, **kwargs)
+        
+        monkeypatch.setattr(warm_search, "search", counting_search)
+        search_promotions._search.cache_clear()
+        
+        first = await search_promotions_tool("vpn privacy", pro_profile)
+        second = await search_promotions_tool("vpn privacy", dict(pro_profile, interests=["cloud", "hosting"]))
+        
+        assert first == second
+        assert len(calls) == 1
+
+    
+    async def test_search_promotions_sees_added_promotions(self, make_index, pro_profile, monkeypatch):
+        """Test that adding promotions invalidates cached search results."""
+        from mcp_server.tools import search_promotions
+        
+        promotion_index = make_index()
+        monkeypatch.setattr(search_promotions, "_promotion_index", promotion_index)
+        monkeypatch.setenv("MAX_SEARCH_RESULTS", "3")
+        new_promotion = {
+            "id": "hosting-flash-sale",
+            "title": "Cloud Hosting Flash Sale",
+            "description": "Cloud hosting at half price this week.",
+            "link": "https://example.com/flash-sale"
         }
+        query = PromotionIndex._promotion_text(new_promotion)
         
-        result = await search_promotions_tool("", user_profile)
+        before = await search_promotions_tool(query, pro_profile)
+        promotion_index.add_promotions([new_promotion])
+        after = await search_promotions_tool(query, pro_profile)
         
-        assert "results" in result
-        assert isinstance(result["results"], list)
+        assert "hosting-flash-sale" not in [promo["id"] for promo in before["results"]]
+        assert after["results"][0]["id"] == "hosting-flash-sale"
 
 
+@pytest.mark.usefixtures("warm_search")
 class TestRankPromotions:
     """Test promotion ranking functionality."""
     
-    @pytest.mark.asyncio
-    async def test_rank_promotions_basic(self):
+    async def test_rank_promotions_basic(self, candidates, pro_profile):
         """Test basic promotion ranking."""
-        candidates = [
-            {
-                "id": "test-1",
-                "title": "Test Promotion 1",
-                "description": "Cloud hosting service",
-                "link": "https://example.com/1",
-                "categories": ["cloud", "hosting"],
-                "price_tier": "medium",
-                "base_ctr": 0.1
-            },
-            {
-                "id": "test-2",
-                "title": "Test Promotion 2", 
-                "description": "Mobile phone deal",
-                "link": "https://example.com/2",
-                "categories": ["mobile", "phone"],
-                "price_tier": "high",
-                "base_ctr": 0.15
-            }
-        ]
+        result = await rank_promotions_tool(candidates, pro_profile)
         
-        user_profile = {
-            "user_type": "professional",
-            "interests": ["cloud", "hosting"],
-            "budget_level": "medium"
-        }
-        
-        result = await rank_promotions_tool(candidates, user_profile)
-        
-        assert "ranked_promotions" in result
-        assert isinstance(result["ranked_promotions"], list)
         assert len(result["ranked_promotions"]) == 2
         
         # Check that results have required fields
         for ranked_promo in result["ranked_promotions"]:
             assert "id" in ranked_promo
+            assert "title" in ranked_promo
+            assert "description" in ranked_promo
+            assert "link" in ranked_promo
             assert "score" in ranked_promo
-            assert isinstance(ranked_promo["score"], (int, float))
+        
+        # Scores come from the model, not the error fallback (e.g. on mutating the read-only candidates)
+        assert {ranked_promo["score"] for ranked_promo in result["ranked_promotions"]} != {0.1}
+        
+        # The array form carries the same ranking as typed arrays
+        arrays = await rank_promotions_tool(candidates, pro_profile, as_arrays=True)
+        
+        assert arrays["scores"].dtype == np.float64
+        assert arrays["ids"].tolist() == [promo["id"] for promo in result["ranked_promotions"]]
+        assert arrays["scores"].tolist() == [promo["score"] for promo in result["ranked_promotions"]]
     
-    @pytest.mark.asyncio
-    async def test_rank_promotions_empty_candidates(self):
-        """Test ranking with empty candidates list."""
+    async def test_rank_promotions_top_k(self):
+        """Test that top_k returns only the best scored promotions."""
+        candidates = [
+            {"id": f"promo-{i}", "categories": ["cloud"], "price_tier": "medium", "base_ctr": 0.05 * i}
+            for i in range(6)
+        ]
         user_profile = {
-            "user_type": "casual",
-            "interests": [],
-            "budget_level": "low"
+            "user_type": "professional",
+            "interests": ["cloud"],
+            "budget_level": "medium"
         }
         
-        result = await rank_promotions_tool([], user_profile)
+        full_result = await rank_promotions_tool(candidates, user_profile)
+        top_result = await rank_promotions_tool(candidates, user_profile, top_k=3)
+        
+        assert top_result["ranked_promotions"] == full_result["ranked_promotions"][:3]
+    
+    @pytest.mark.parametrize("top_k,expected_ids", [(None, ["test-1", "test-2"]), (1, ["test-1"])])
+    async def test_rank_promotions_error_fallback(self, candidates, casual_profile, monkeypatch, top_k, expected_ids):
+        """Test that a ranker failure returns the candidates in order with default scores, truncated to top_k."""
+        def failing_ranker():
+            raise RuntimeError("ranker unavailable")
+        
+        monkeypatch.setattr(sys.modules[rank_promotions_tool.__module__], "get_ranker", failing_ranker)
+        
+        result = await rank_promotions_tool(candidates, casual_profile, top_k)
+        arrays = await rank_promotions_tool(candidates, casual_profile, top_k, as_arrays=True)
+        
+        assert [promo["id"] for promo in result["ranked_promotions"]] == expected_ids
+        assert [promo["score"] for promo in result["ranked_promotions"]] == [0.1] * len(expected_ids)
+        assert arrays["ids"].tolist() == expected_ids
+        assert arrays["scores"].tolist() == [0.1] * len(expected_ids)
+    
+    async def test_rank_promotions_empty_candidates(self, casual_profile):
+        """Test ranking with empty candidates list."""
+        result = await rank_promotions_tool([], casual_profile)
         
-        assert "ranked_promotions" in result
         assert result["ranked_promotions"] == []
 
 
 class TestOptimizeAdSlots:
     """Test ad slot optimization functionality."""
     
-    @pytest.mark.asyncio
-    async def test_optimize_ad_slots_basic(self):
-        """Test basic ad slot optimization."""
+    async def test_optimize_ad_slots_cases(self):
+        """Test ad slot optimization for basic, no-promotion and empty-result inputs."""
         search_results = [
             "Best cloud hosting providers 2024",
             "How to choose web hosting",
@@ -159,103 +407,188 @@ class TestOptimizeAdSlots:
             }
         ]
         
-        result = await optimize_ad_slots_tool(search_results, promotions)
+        plain_results = ["Result 1", "Result 2", "Result 3"]
         
-        assert "injected_results" in result
-        assert isinstance(result["injected_results"], list)
-        assert len(result["injected_results"]) >= len(search_results)
-        
-        # Check that ads are properly marked
-        has_sponsored_content = any(
-            "🎯 [SPONSORED]" in item 
-            for item in result["injected_results"]
+        # The cases share no state, so run them concurrently
+        basic, no_promotions, empty_results = await asyncio.gather(
+            optimize_ad_slots_tool(search_results, promotions),
+            optimize_ad_slots_tool(plain_results, []),
+            optimize_ad_slots_tool([], promotions)
         )
-        assert has_sponsored_content
+        
+        assert len(basic["injected_results"]) >= len(search_results)
+        
+        # Check that ads are properly marked, scanning all results in one pass
+        assert "🎯 [SPONSORED]" in "\n".join(basic["injected_results"])
+        
+        # No promotions leaves the results untouched
+        assert no_promotions["injected_results"] == plain_results
+        
+        # No search results means nothing to inject into
+        assert empty_results["injected_results"] == []
     
-    @pytest.mark.asyncio
-    async def test_optimize_ad_slots_no_promotions(self):
-        """Test optimization with no promotions."""
-        search_results = ["Result 1", "Result 2", "Result 3"]
+    def test_extract_context_keywords(self):
+        """Test that context keywords are the most frequent non-stopwords, ties in first-seen order."""
+        from mcp_server.tools.optimize_ad_slots import _extract_context_keywords
         
-        result = await optimize_ad_slots_tool(search_results, [])
+        search_results = [
+            "Cloud hosting for the web",
+            "Cheap cloud servers and web hosting",
+            "Gaming laptops",
+            "Cloud storage deals",
+            "Phone plans"
+        ]
         
-        assert "injected_results" in result
-        assert result["injected_results"] == search_results
+        assert _extract_context_keywords(search_results, 1) == ["cloud", "hosting", "web", "cheap", "servers"]
+        assert _extract_context_keywords([], 0) == []
+
+
+@pytest.mark.usefixtures("warm_search")
+class TestBatchExecute:
+    """Test batch execution functionality."""
     
-    @pytest.mark.asyncio
-    async def test_optimize_ad_slots_empty_results(self):
-        """Test optimization with empty search results."""
-        promotions = [
-            {
-                "id": "test-promo",
-                "title": "Test Promotion",
-                "description": "Test description",
-                "link": "https://example.com"
-            }
+    async def test_batch_execute_with_refs(self, pro_profile):
+        """Test batch execution resolving references between calls."""
+        calls = [
+            {"id": "expand", "tool": "expand_query", "args": {"query": "cloud hosting"}},
+            {"id": "search", "tool": "search_promotions", "args": {
+                "query": {"$ref": "expand.expanded_queries.0"},
+                "user_profile": pro_profile
+            }},
+            {"id": "rank", "tool": "rank_promotions", "args": {
+                "candidates": {"$ref": "search.results"},
+                "user_profile": pro_profile
+            }}
+        ]
+        
+        result = await batch_execute_tool(calls)
+        
+        assert result["errors"] == {}
+        assert set(result["results"]) == {"expand", "search", "rank"}
+        assert len(result["results"]["rank"]["ranked_promotions"]) == len(result["results"]["search"]["results"])
+    
+    async def test_batch_execute_stop_on_error(self):
+        """Test that failures skip dependent and later calls."""
+        calls = [
+            {"id": "bad", "tool": "expand_query", "args": {"wrong_arg": "x"}},
+            {"id": "after", "tool": "expand_query", "args": {"query": "laptop"}, "depends_on": ["bad"]}
         ]
         
-        result = await optimize_ad_slots_tool([], promotions)
+        result = await batch_execute_tool(calls, stop_on_error=True)
         
-        assert "injected_results" in result
-        assert result["injected_results"] == []
+        assert set(result["errors"]) == {"bad", "after"}
+        assert result["results"] == {}
+    
+    async def test_batch_execute_circular_dependency(self):
+        """Test that circular dependencies are rejected."""
+        calls = [
+            {"id": "a", "tool": "expand_query", "args": {"query": "x"}, "depends_on": ["b"]},
+            {"id": "b", "tool": "expand_query", "args": {"query": "y"}, "depends_on": ["a"]}
+        ]
+        
+        with pytest.raises(ValueError):
+            await batch_execute_tool(calls)
 
 
+@pytest.mark.usefixtures("warm_search")
 class TestIntegration:
     """Integration tests for the complete pipeline."""
     
-    @pytest.mark.asyncio
-    async def test_full_pipeline(self):
+    async def test_full_pipeline(self, pro_profile):
         """Test the complete PromoSearch pipeline."""
         # Step 1: Expand query
         query = "cloud hosting deals"
         expanded_result = await expand_query_tool(query)
         assert len(expanded_result["expanded_queries"]) > 0
         
-        # Step 2: Search promotions
-        user_profile = {
-            "user_type": "business",
-            "interests": ["hosting", "cloud", "web"],
-            "budget_level": "medium"
-        }
+        # Step 2: Search promotions for several expansions concurrently
+        search_results = await asyncio.gather(*(
+            search_promotions_tool(expanded_query, pro_profile, include_lookup=True)
+            for expanded_query in expanded_result["expanded_queries"][:3]
+        ))
         
-        search_result = await search_promotions_tool(
-            expanded_result["expanded_queries"][0], 
-            user_profile
-        )
-        promotions = search_result["results"]
+        # Merge the per-search id lookups, earlier searches winning on duplicates
+        promotion_lookup = dict(ChainMap(*(search_result["by_id"] for search_result in search_results)))
+        promotions = list(promotion_lookup.values())
         
         if len(promotions) > 0:
-            # Step 3: Rank promotions
-            ranking_result = await rank_promotions_tool(promotions, user_profile)
-            ranked_promotions = ranking_result["ranked_promotions"]
+            # Steps 3 and 4: rank, then inject the top promotions as ads
+            ranking_result = await rank_promotions_tool(promotions, pro_profile)
             
+            ranked_promotions = ranking_result["ranked_promotions"]
             assert len(ranked_promotions) == len(promotions)
             
-            # Step 4: Optimize ad slots
+            # Ranked promotions carry their details, so no join back to the search results
+            top_promotions = ranked_promotions[:2]
+            for ranked_promo in top_promotions:
+                assert ranked_promo["title"] == promotion_lookup[ranked_promo["id"]]["title"]
+                assert "description" in ranked_promo
+                assert "link" in ranked_promo
+            
             mock_search_results = [
                 "Cloud hosting comparison",
                 "Best hosting providers",
                 "Web hosting guide"
             ]
-            
-            # Get top promotions with details
-            top_promotions = []
-            promotion_lookup = {p["id"]: p for p in promotions}
-            
-            for ranked_promo in ranked_promotions[:2]:
-                if ranked_promo["id"] in promotion_lookup:
-                    promo_details = promotion_lookup[ranked_promo["id"]].copy()
-                    top_promotions.append(promo_details)
-            
-            optimization_result = await optimize_ad_slots_tool(
-                mock_search_results, 
-                top_promotions
-            )
+            optimization_result = await optimize_ad_slots_tool(mock_search_results, top_promotions)
             
             injected_results = optimization_result["injected_results"]
             assert len(injected_results) >= len(mock_search_results)
 
 
+
+class TestServer:
+    """Test the MCP server wrappers around the tools."""
+    
+    @pytest.fixture
+    def server(self, tmp_path, monkeypatch):
+        """The server module, imported with its log file under tmp_path."""
+        monkeypatch.chdir(tmp_path)
+        from mcp_server import main
+        return main
+    
+    async def test_tool_results_go_through_serializer(self, server, warm_search, candidates, casual_profile, monkeypatch):
+        """Test that a tool call over the MCP client returns the result encoded by the serializer."""
+        from fastmcp import Client
+        
+        serialized = []
+        serialize = server._serialize_tool_result
+        
+        def recording_serialize(result):
+            serialized.append(serialize(result))
+            return serialized[-1]
+        
+        monkeypatch.setattr(server, "_serialize_tool_result", recording_serialize)
+        
+        arguments = {
+            "candidates": [dict(candidate) for candidate in candidates],
+            "user_profile": dict(casual_profile),
+            "top_k": 2
+        }
+        async with Client(server.mcp) as client:
+            response = await client.call_tool("rank_promotions", arguments)
+        
+        expected = await rank_promotions_tool(arguments["candidates"], arguments["user_profile"], 2)
+        assert [content.text for content in response.content] == serialized
+        assert json.loads(serialized[0]) == expected
+    
+    @pytest.mark.parametrize("orjson_available", [True, False])
+    def test_serializer_encodes_numpy_values(self, server, monkeypatch, orjson_available):
+        """Test that NumPy arrays and scalars serialize as JSON and unknown types raise TypeError."""
+        if orjson_available and not server.ORJSON_AVAILABLE:
+            pytest.skip("orjson is not installed")
+        monkeypatch.setattr(server, "ORJSON_AVAILABLE", orjson_available)
+        
+        ids = np.empty(2, dtype=object)
+        ids[:] = ["a", "b"]
+        result = {"ids": ids, "scores": np.array([0.5, 0.25]), "count": np.int64(2)}
+        
+        assert json.loads(server._serialize_tool_result(result)) == {
+            "ids": ["a", "b"], "scores": [0.5, 0.25], "count": 2
+        }
+        with pytest.raises(TypeError):
+            server._serialize_tool_result({"value": object()})
+
 if __name__ == "__main__":
     # Run tests directly
     pytest.main([__file__, "-v"])